@@ -3,6 +3,8 @@ import argparse
 import coremltools
 from coremltools.models import datatypes
 
+from file_scanner import scan_paths
+
 
 parser = argparse.ArgumentParser(description='Clean up a folder of ML model classifiers and fix label names, add metadata to mlmodels and fix tensor names')
 parser.add_argument('-m', '--modeldir', type=str, help='folder containing core ml models to clean', default='./Models/Classifiers/3rdParty/', required=False)
@@ -102,14 +104,8 @@ def updateModel(originalModelFileName):
 
 model_paths = []
 
-for filename in os.listdir(models_path):
-	if filename.endswith('.mlmodel'):	
-		model_path = filename
-
-		if model_path:
-			model_paths.append(model_path)
-	else:
-		continue
+for path in scan_paths(models_path, '.mlmodel', recursive=False):
+	model_paths.append(os.path.basename(path))
 
 
 
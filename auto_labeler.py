@@ -1,317 +1,359 @@
 import os 
 import csv   
 import argparse
-import PIL.Image
-import coremltools
 import random
-import math
+import itertools
 import time
 
+from frame_decoder import SKIPPED, decode_images
+from embedding_cache import EmbeddingCache
+from run_journal import RunJournal
+from frame_pack import PackedFrames, packed_paths
+from file_scanner import scan_paths
+from file_sampling import reservoir_sample, stratified_sample
+from label_writers import HTMLReportWriter, ParquetLabelWriter
+from labeler_shards import merge_shards, run_workers, shard_of, shard_output
+from label_matrix import LabelVocabulary
+from label_calibration import load_thresholds
+from model_cache import ModelCache
+from labeler_models import load_selected_models, load_trunk, predict_matrix
+
 parser = argparse.ArgumentParser(description='Use a folder of ML model classifiers to label a local unlabeled data set')
 parser.add_argument('-m', '--modeldir', type=str, help='folder containing core ml models to use as labelers. Each image to label will be run through each model', default='./Models/Classifiers/Cleaned/', required=False)
 parser.add_argument('-i', '--imagedir', type=str, help="folder containing unlabeled images to be labeled", default="./images", required=True)
 parser.add_argument('-o', '--output', type=str, help="destination for labeled file containing multi labels", default="./labels", required=False)
-parser.add_argument('-t', '--type', type=str, help="csv or html?", default="csv", required=False)
+parser.add_argument('-t', '--type', type=str, help="csv, html or parquet (every model's full score vector)", default="csv", required=False)
 parser.add_argument('-pre', '--prefix', type=str, help="image url prefix, useful for adding a cloud storage provider URL for example", default="", required=False)
 parser.add_argument('-l', '--limit', type=int, help="limit the number of images we label - useful for testing", default="1000000000000", required=False)
-parser.add_argument('-r', '--random', type=bool, help="limit the number of images we label - useful for testing", default=False, required=False)
+parser.add_argument('-r', '--random', type=bool, help="label a random sample of --limit images, in random order - useful for testing", default=False, required=False)
+parser.add_argument('-st', '--stratified', type=bool, help="like --random, but sample evenly from every folder (each concept or source video) so a small test run still covers them all", default=False, required=False)
 parser.add_argument('-p', '--probabilities', type=bool, help="report probabilities rather than predicted class label (html only)", default=False, required=False)
+parser.add_argument('-ps', '--page-size', type=int, help="images per html report page", default=500, required=False)
+parser.add_argument('-k', '--top-k', type=int, help="highest scores shown per image in the html report, the rest load on demand", default=5, required=False)
+parser.add_argument('-b', '--batch-size', type=int, help="number of images sent to each model in a single batched predict call", default=1, required=False)
+parser.add_argument('-dw', '--decode-workers', type=int, help="number of workers decoding and resizing images ahead of inference, 0 decodes inline", default=0, required=False)
+parser.add_argument('-dm', '--decode-mode', type=str, help="thread or process decode workers", default="thread", required=False)
+parser.add_argument('-dq', '--decode-queue', type=int, help="max number of decoded images waiting for inference, defaults to 4 per decode worker", default=0, required=False)
+parser.add_argument('-e', '--extensions', type=str, help="comma separated image extensions to label, matched case insensitively", default=".jpg,.jpeg", required=False)
+parser.add_argument('-sw', '--scan-workers', type=int, help="threads listing imagedir's folders at once, which pays off on network file systems", default=8, required=False)
+parser.add_argument('-fi', '--file-index', type=str, help="sqlite file indexing imagedir's folders, so later runs only list folders that changed", default="", required=False)
+parser.add_argument('-pk', '--packed', type=str, help="frames packed by pack_frames.py from imagedir, read from memory mapped shards instead of decoding every image", default="", required=False)
+parser.add_argument('-c', '--cache', type=str, help="sqlite file caching embeddings and predictions by image content, so re-runs only compute what is missing", default="", required=False)
+parser.add_argument('-rg', '--row-group', type=int, help="rows per parquet row group", default=65536, required=False)
+parser.add_argument('-rs', '--resume', type=bool, help="resume an interrupted run, skipping images recorded in the output's .journal and appending to the output", default=False, required=False)
+parser.add_argument('-cp', '--checkpoint', type=int, help="fsync the output and journal every this many labeled images", default=5000, required=False)
+parser.add_argument('-ci', '--checkpoint-interval', type=float, help="also fsync the output and journal at least every this many seconds", default=30.0, required=False)
+parser.add_argument('-si', '--shard-index', type=int, help="only label the files in this shard of the file list", default=0, required=False)
+parser.add_argument('-ns', '--num-shards', type=int, help="number of shards the file list is partitioned into by path hash, for splitting a run across machines", default=1, required=False)
+parser.add_argument('-w', '--workers', type=int, help="run this many labeler processes on this machine, one shard each, then merge their output (csv only)", default=0, required=False)
+parser.add_argument('-mg', '--merge', type=bool, help="instead of labeling, merge the csv outputs <output>.shard-<index>-of-<num-shards> into output", default=False, required=False)
+parser.add_argument('-s', '--seed', type=int, help="random seed for --random and --stratified, so every shard sees the same sampled file list", default=None, required=False)
+parser.add_argument('-tr', '--trunk', type=str, help="shared feature extractor model (.mlmodel or .onnx), run once per image to feed the classifier heads in modeldir", default="", required=False)
+parser.add_argument('-th', '--thresholds', type=str, help="calibration json from calibrate_labeler.py, label each image with every label scoring above its calibrated threshold rather than each model's top label", default="", required=False)
+parser.add_argument('-ms', '--models', type=str, help="comma separated model names or glob patterns to label with, for example shot.angle,shot.framing. defaults to every model in modeldir", default="", required=False)
+parser.add_argument('-mc', '--model-cache', type=str, help="folder caching compiled models and their descriptions by model file hash, shared between runs to cut startup time", default="", required=False)
+parser.add_argument('-be', '--backend', type=str, help="auto, coreml, onnx or numpy. auto prefers numpy heads, then coreml on macOS or onnx elsewhere", default="auto", required=False)
 
-args = parser.parse_args()
+Height = 224 # use the correct input image height 
+Width = 224 # use the correct input image width
 
-start = time.time()
 
+# run every model over a batch of (filepath, image) and write one row per image, in order
+def label_batch(writer, batch):
+	# images our cache fully covers were never decoded
+	images = [None if image is SKIPPED else image for filepath, image in batch]
 
-# load our models into our models array
-dir_path = os.getcwd()
+	keys = None
+	if cache is not None and args.packed:
+		keys = [cache.frame_key(image) for filepath, image in batch]
+	elif cache is not None:
+		keys = [cache.image_key(filepath) for filepath, image in batch]
 
-models_path = os.path.normpath( os.path.join(dir_path, args.modeldir) )
+	# one batched call per model, filling a single (images x labels) score matrix in the same order as our images
+	matrix = predict_matrix(models, vocabulary, images, trunk, cache, keys)
 
-print('Loading Models from: ' + models_path)
+	# parquet keeps every models full score vector, a row group at a time
+	if args.type == 'parquet':
+		writer.write_batch([args.prefix + filepath for filepath, image in batch], matrix)
+		for filepath, image in batch:
+			print("labeled " + filepath)
+		return
 
-models = []
+	# every label above its calibrated threshold, or the class label of every model, for every image at once
+	if thresholds is not None:
+		predicted = vocabulary.above(matrix, thresholds)
+	else:
+		predicted = vocabulary.predicted(matrix).tolist()
 
-modelfiles = os.listdir(models_path)
-modelfiles.sort()
+	#write all of our predictions out to our CSV
+	if args.type == 'csv':
+		for index in range(len(batch)):
+			writer.writerow([args.prefix + batch[index][0]] + predicted[index])
+	else:
+	# write HTML label version with file name for IMG tag, etc
+		writer.write_batch([filepath for filepath, image in batch], predicted, matrix, images)
 
-for filename in modelfiles:
-	if filename.endswith('.mlmodel'):	
-		model_path = (os.path.join(models_path, filename))
+	for filepath, image in batch:
+		print("labeled " + filepath)
 
-		if model_path:
-			model = coremltools.models.MLModel(model_path)
+# our files in labeling order. without --random or --stratified this is a generator
+# straight off the scan, so labeling starts as soon as the first files are found
+def list_files(args):
+	# a packed frame set already knows its files
+	if args.packed:
+		files = packed_paths(args.packed)
 
-			if model:
-				print('Loaded model ' + filename)
-				models.append(model)
-			else:
-				print('Unable to load model at ' + model_path)
+	# recurse through our image directory and run inference on each image.
+	# the scan streams, so a test run samples or stops as files are found rather than listing everything first
 	else:
-		continue
+		extensions = [extension.strip() for extension in args.extensions.split(',') if extension.strip()]
+		files = scan_paths(args.imagedir, extensions, workers=args.scan_workers, index=args.file_index or None)
 
+	#do we limit our file count so we can do a test run?
+	limit = args.limit if args.limit != 0 else None
+	rng = random.Random(args.seed)
+
+	#do we sample our files at random, overall or evenly per folder?
+	if args.stratified == True:
+		all_files = stratified_sample(files, limit, rng)
+	elif args.random == True:
+		all_files = reservoir_sample(files, limit, rng)
+	else:
+		all_files = itertools.islice(files, limit)
 
-end = time.time()
+	return all_files
 
-modeltime = end - start
+def merge(args):
+	start = time.time()
 
-print("")
-print("Loading models took " + str(modeltime) + " seconds")
-print("")
+	shard_paths = [shard_output(args.output, shard_index, args.num_shards) for shard_index in range(args.num_shards)]
+	try:
+		merged = merge_shards(args.output, shard_paths, list(list_files(args)), args.prefix)
+	except ValueError as error:
+		parser.error(str(error) + ', merge with the same --imagedir, --limit, --random, --stratified and --seed the shards were labeled with')
 
-Height = 224 # use the correct input image height 
-Width = 224 # use the correct input image width
+	print("Merged " + str(merged) + " rows from " + str(args.num_shards) + " shards in " + str(time.time() - start) + " seconds")
 
+	return shard_paths
 
-def load_image(path, resize_to=None):
+if __name__ == '__main__':
 
-	try:
-		img = PIL.Image.open(path)
-		#verify apparently breaks the image!?
-		# img.verify()
+	args = parser.parse_args()
 
-	except Exception:
-		print('Unable to load image' + path)
-		return None
+	if args.limit < 0:
+		parser.error('--limit must be 0 (every image) or more')
 
-	if resize_to is not None:
-		try:
-			img = img.resize(resize_to, PIL.Image.ANTIALIAS)
-		except Exception:
-			print('Unable to resize image' + path)
-			return None
+	# a parquet file is only readable once its footer is written, and html reports are spread over many pages,
+	# so there is nothing to resume into. re-running with --cache is cheap instead
+	if args.type in ['parquet', 'html'] and args.resume:
+		parser.error('--resume is only supported for csv output')
 
-	# ensure we pass our image as RGB - some images might be single channel or RGBA
-	if img.mode != 'RGB':
-		try:
-			img = img.convert(mode='RGB')
-		except Exception:
-			print('Unable to convert image to RGB' + path)
-			return None
-
-	return img
-
-def html_header(): 
-	html_header = """
-	<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN"
-        "http://www.w3.org/TR/html4/loose.dtd">
-
-	<html>
-
-		<head>
-
-		<title>Synopsis Data Set Auto Labeler Output</title>
-		<style>
-
-		body {
-		  font-family: Arial, Sans-serif;
-		  font-size: 10pt;
-		}
-		.masonry-layout {
-		  column-count: 3;
-		  column-gap: 0;
-		}
-		.masonry-layout__panel {
-		  break-inside: avoid;
-		  margin:5px;
-		  padding: 5px;
-		}
-
-		.masonry-layout__panel-content {
-		  padding: 10px;
-		  border-radius: 10px;
-		  border: solid 1px gray;
-		  background-color: #ddd;
-		}
-
-		@media screen and (min-width: 600px) {
-			.masonry-layout {
-			  column-count: 2;
-			 }
-		}
-		@media screen and (min-width: 800px) {
-			.masonry-layout {
-			  column-count: 3;
-			 }
-		}
-
-		@media screen and (min-width: 1000px) {
-			.masonry-layout {
-			  column-count: 4;
-			 }
-		}
-
-		@media screen and (min-width: 1200px) {
-			.masonry-layout {
-			  column-count: 5;
-			 }
-		}
-
-		#bar {
-		 height: 100%;
-		 background-color: green;
-		}
-
-		#label {
-
-		}
-
-		</style
-		</head>
-
-	<body>
-	<div class="masonry-layout">
-
-	"""
-	return html_header
-
-def html_entry_label(filepath, labels):
-	html_entry = """
-	<div class="masonry-layout__panel">
-    	<div class="masonry-layout__panel-content" align="center">
-
-		<a href="file://{}"><img src="file://{}" width="100%" target="_blank"/></a><br/> {}
-		</div>
-	</div>
-	"""
-
-	# item 0 is the image name
-	del labels[0]
-
-	filepath = os.path.normpath( os.path.join(dir_path, filepath) )
-	return html_entry.format(filepath, filepath, '<br />'.join(labels) )
-
-def html_entry_scores_table(items):
-	
-	html = '<div style="max-height:300px; overflow-y:scroll">'
-	html += '<table style="width:100%;">'
-
-	for i in range(0, len(items)):
-		label = items[i][0]
-		score = items[i][1]
-
-		percentString = str( math.ceil( score * 10000.0) / 100.0 ) + '%'
-
-		html += '<tr>'
-		html += '<td>'
-		html += '<div id="bar" style="height:17px; width:' + percentString + '">'+ label + '</div>'
-		html += '</td>'
-		html += '<td>' + percentString + '</td>'
-		html += '</tr>'
-
-	html += '</table>'
-	html += '</div>'
-
-	return html
-
-def html_entry_scores(filepath, scores):
-	html_entry = """
-	<div class="masonry-layout__panel">
-    	<div class="masonry-layout__panel-content" align="center">
-
-		<a href="file://{}"><img src="file://{}" width="100%" target="_blank"/></a><br/> {}
-		</div>
-	</div>
-	"""
+	if args.merge:
+		merge(args)
+		raise SystemExit(0)
+
+	# fan out to one process per shard and merge their output once they are all done
+	if args.workers > 1:
+		if args.type != 'csv':
+			parser.error('--workers only supports csv output')
+
+		# our workers shard the whole file list themselves, inside a cluster shard they would overlap with the other machines
+		if args.num_shards != 1 or args.shard_index != 0:
+			parser.error('--workers shards the whole file list, it can not be combined with --num-shards or --shard-index')
+
+		# resumed shards must sample with the seed their journals were written with
+		if args.seed is None and args.resume:
+			args.seed = RunJournal(shard_output(args.output, 0, args.workers)).recorded_seed()
+
+		if args.seed is None:
+			args.seed = random.randrange(1 << 31)
+
+		failed = run_workers(os.path.abspath(__file__), args.output, args.workers, args.seed)
+		if failed:
+			print(str(failed) + ' shards failed, rerun with --resume to finish them')
+			raise SystemExit(1)
+
+		args.num_shards = args.workers
+		for shard_path in merge(args):
+			os.remove(shard_path)
+			os.remove(shard_path + '.journal')
+
+		# a journal left from an earlier single process run does not describe our merged output,
+		# without one --resume refuses to touch it
+		if os.path.exists(args.output + '.journal'):
+			os.remove(args.output + '.journal')
+
+		raise SystemExit(0)
+
+	start = time.time()
 
-	filepath = os.path.normpath( os.path.join(dir_path, filepath) )
 
-	# sort our scores dictionary to highest scoring and to 2 arrays
-	# this is a list of tupes of key values.
-	items = sorted(scores.items(), key = lambda kv:(kv[1], kv[0]))
-	items.reverse()
+	# load our models into our models array
+	dir_path = os.getcwd()
 
-	return html_entry.format(filepath, filepath, html_entry_scores_table(items ) )
+	models_path = os.path.normpath( os.path.join(dir_path, args.modeldir) )
 
-def html_footer():
-	html_footer = """
-	</div>
-	</body>
+	print('Loading Models from: ' + models_path)
 
-	</html>
-	"""
-	return html_footer
+	model_cache = None
+	if args.model_cache:
+		model_cache = ModelCache(args.model_cache)
 
-# open a file for writing
+	try:
+		models = load_selected_models(models_path, args.backend, model_cache, args.models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	# every models labels side by side, so each batch is scored into one matrix
+	try:
+		vocabulary = LabelVocabulary(models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	# classifier heads share a single backbone, so we only run it once per image
+	trunk = None
+	if args.trunk:
+		trunk_path = os.path.normpath( os.path.join(dir_path, args.trunk) )
+		trunk = load_trunk(trunk_path, cache=model_cache)
+		print('Loaded feature extractor ' + trunk_path)
+	elif any(model.is_head for model in models):
+		parser.error('modeldir contains classifier heads, pass --trunk with the feature extractor they were split from')
+
+	# multi label output, each label with its own cutoff
+	thresholds = None
+	if args.thresholds:
+		thresholds = load_thresholds(args.thresholds, vocabulary)
+
+	cache = None
+	if args.cache:
+		cache = EmbeddingCache(args.cache)
+
+	# images with cached scores from every model do not need decoding at all
+	# unreadable paths are not cached, they fall through to the decoder which reports and skips them
+	def is_cached(filepath):
+		try:
+			return cache.has_scores(cache.image_key(filepath), models, trunk)
+		except OSError:
+			return False
+
+	end = time.time()
+
+	modeltime = end - start
 
-# for reference, for multi label we want to do
-# : gs://calm-trees-123-vcm/flowers/images/5217892384_3edce91761_m.jpg,dandelion,tulip,rose
-# from https://cloud.google.com/vision/automl/docs/prepare
+	print("")
+	print("Loading models took " + str(modeltime) + " seconds")
+	print("")
 
-start = time.time()
+	# open a file for writing
 
-all_files = []
-with open(args.output, 'wb') as writer:
+	# for reference, for multi label we want to do
+	# : gs://calm-trees-123-vcm/flowers/images/5217892384_3edce91761_m.jpg,dandelion,tulip,rose
+	# from https://cloud.google.com/vision/automl/docs/prepare
+
+	start = time.time()
+
+	# csv output keeps a journal of completed images so a crashed run can pick up where it left off
+	journal = None
+	completed = set()
+	output = None
 
 	if args.type == 'csv':
- 		writer = csv.writer(writer)
- 	else:
- 		writer.write(html_header())
+		journal = RunJournal(args.output, args.checkpoint, args.checkpoint_interval)
 
-	# recurse through our image directory and run inference on each image
-	for subdir, dirs, files in os.walk(args.imagedir):
-		for file in files:
-			#print os.path.join(subdir, file)
-			filepath = subdir + os.sep + file
+		# a sampled run has to resume with the seed it started with, or it would label a different sample
+		sampled = args.random == True or args.stratified == True
 
-			if filepath.endswith(".jpg"):
-				all_files.append(filepath)
+		if args.resume:
+			recorded = journal.recorded_seed()
 
-	#do we shuffle our files?
-	if args.random == True:
-		random.shuffle(all_files)
+			if sampled and args.seed is None and recorded is None:
+				parser.error('resuming a --random or --stratified run needs the --seed it was started with')
+			if sampled and args.seed is not None and recorded is not None and args.seed != recorded:
+				parser.error('this run was started with --seed ' + str(recorded) + ', not ' + str(args.seed))
+			if args.seed is None:
+				args.seed = recorded
 
-	#do we limit our file count so we can do a test run?
-	if args.limit is not 0:
-		all_files = all_files[:args.limit]
-
-	for filepath in all_files:
-		image = load_image(filepath, resize_to=(Width, Height))
-		if image != None:
-			labels = []
-			scores = {}
-
-			# prepend our prefix if we have it
-			if args.prefix:
-				labels.append( args.prefix + filepath )
-			else:
-				labels.append(filepath)
-
-			for model in models:
-				prediction = model.predict({'Image': image})
-
-				score = prediction['Scores']
-				scores.update(score)
-
-				label = prediction['Class Label']
-				labels.append(label)
-
-			#write all of our predictions out to our CSV
-			if args.type == 'csv':
-				writer.writerow(labels)
-			else:
-			# write HTML label version with file name for IMG tag, etc
-				
-				if args.probabilities:
-					writer.write( html_entry_scores(filepath, scores) )
-				else:		
-					writer.write( html_entry_label(filepath, labels) )
+			try:
+				completed, offset = journal.resume()
+			except ValueError as error:
+				parser.error(str(error))
 
-			print("labeled " + filepath)
+			print('Resuming, ' + str(len(completed)) + ' images already labeled')
+		elif sampled and args.seed is None:
+			args.seed = random.randrange(1 << 31)
+
+		journal.start(resume=args.resume, seed=args.seed if sampled else None)
+
+		output = open(args.output, 'a' if args.resume else 'w', newline='')
+		writer = csv.writer(output)
+	elif args.type == 'parquet':
+		output = open(args.output, 'wb')
+		writer = ParquetLabelWriter(output, vocabulary, args.row_group)
+	else:
+		writer = HTMLReportWriter(args.output, dir_path, vocabulary, args.page_size, args.top_k, args.probabilities)
+
+	all_files = list_files(args)
+
+	# only keep the files in our shard, filtering as they stream past
+	if args.num_shards > 1:
+		all_files = (filepath for filepath in all_files if shard_of(filepath, args.imagedir, args.num_shards) == args.shard_index)
+
+	# skip anything a previous run already labeled
+	if completed:
+		all_files = (filepath for filepath in all_files if filepath not in completed)
+
+	# gather decoded images into fixed size batches so each model is called once per batch
+	batch = []
+	processed = 0
+	if args.packed:
+		# frames are views into memory mapped shards, there is nothing to decode
+		decoded = PackedFrames(args.packed).read(all_files)
+	else:
+		decoded = decode_images(all_files, resize_to=(Width, Height), workers=args.decode_workers, mode=args.decode_mode, queue_size=args.decode_queue, skip=is_cached if cache is not None else None)
+
+	for filepath, image in decoded:
+		processed += 1
+
+		if image is not None:
+			batch.append((filepath, image))
+
+		if len(batch) >= args.batch_size:
+			label_batch(writer, batch)
+
+			if journal is not None:
+				journal.record([filepath for filepath, image in batch])
+				if journal.due():
+					journal.checkpoint(output)
+
+			batch = []
+
+	# flush our last partial batch
+	if batch:
+		label_batch(writer, batch)
 
+		if journal is not None:
+			journal.record([filepath for filepath, image in batch])
 
-	if args.type == 'html':
-	 		writer.write(html_footer())
+	if args.type in ['html', 'parquet']:
+		writer.close()
 
-end = time.time()
+	if journal is not None:
+		journal.checkpoint(output)
+		journal.close()
 
-predictiontime = end - start
+	if output is not None:
+		output.close()
 
-print("")
-print("Completed Processing")
-print("")
-print( str( len(all_files) ) + " images processed in " + str(predictiontime) + " seconds")
-print( str( len(all_files)/predictiontime ) + "images / second")
-print("")
+	if cache is not None:
+		cache.close()
 
+	end = time.time()
 
+	predictiontime = end - start
 
+	print("")
+	print("Completed Processing")
+	print("")
+	print( str( processed ) + " images processed in " + str(predictiontime) + " seconds")
+	print( str( processed/predictiontime ) + "images / second")
+	print("")
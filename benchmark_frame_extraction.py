@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+parser = argparse.ArgumentParser(description='Benchmark the decode modes of extract_frames_recursive.py on a synthetic clip generated locally with ffmpeg')
+parser.add_argument('-s', '--size', type=str, help="clip size, eg 3840x2160 for a 4K master", default="3840x2160", required=False)
+parser.add_argument('-d', '--duration', type=int, help="clip length in seconds", default=60, required=False)
+parser.add_argument('-r', '--rate', type=int, help="clip frame rate", default=25, required=False)
+parser.add_argument('-g', '--gop', type=int, help="keyframe interval in frames, long GOP sources are where keyframe and seek decoding pay off", default=250, required=False)
+parser.add_argument('-c', '--codec', type=str, help="libx264 or prores_ks", default="libx264", required=False)
+parser.add_argument('-n', '--interval', type=float, help="seconds between extracted frames", default=3.0, required=False)
+parser.add_argument('-mw', '--max-width', type=int, help="also pass --max-width to the extractor", default=0, required=False)
+parser.add_argument('-m', '--modes', type=str, help="comma separated decode modes to compare", default="full,keyframes,seek", required=False)
+parser.add_argument('-k', '--keep', type=bool, help="keep the clip and extracted frames", default=False, required=False)
+
+args = parser.parse_args()
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_frames_recursive.py')
+extension = '.mov' if args.codec.startswith('prores') else '.mp4'
+
+
+def makeClip(folder):
+	clip = os.path.join(folder, 'clip' + extension)
+
+	print('Generating ' + args.size + ' ' + args.codec + ' clip, ' + str(args.duration) + ' seconds')
+	subprocess.check_call(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+		"-f", "lavfi", "-i", "testsrc2=size=" + args.size + ":rate=" + str(args.rate) + ":duration=" + str(args.duration),
+		"-c:v", args.codec, "-g", str(args.gop), "-pix_fmt", "yuv422p10le" if extension == '.mov' else "yuv420p", clip])
+
+	return clip
+
+def runMode(clip_folder, output, mode):
+	command = [sys.executable, script, clip_folder, output, extension, "--decode", mode, "--interval", str(args.interval), "--workers", "1", "--overwrite", "True"]
+	if args.max_width:
+		command += ["--max-width", str(args.max_width)]
+
+	start = time.time()
+	subprocess.check_call(command, stdout=subprocess.DEVNULL)
+	seconds = time.time() - start
+
+	frames = len([f for f in os.listdir(output) if f.endswith('.jpg')])
+	return frames, seconds
+
+if __name__ == '__main__':
+
+	folder = tempfile.mkdtemp(prefix='frame_extraction_benchmark')
+	clip_folder = os.path.join(folder, 'clip')
+	os.mkdir(clip_folder)
+
+	try:
+		makeClip(clip_folder)
+
+		results = []
+		for mode in args.modes.split(','):
+			output = os.path.join(folder, mode)
+			os.mkdir(output)
+
+			frames, seconds = runMode(clip_folder, output, mode)
+			results.append( (mode, frames, seconds) )
+
+		baseline = results[0][2]
+
+		print("")
+		print('%-10s %8s %10s %12s %14s %10s' % ('mode', 'frames', 'seconds', 'frames/sec', 'x realtime', 'speedup'))
+		for mode, frames, seconds in results:
+			print('%-10s %8d %10.2f %12.2f %14.2f %9.2fx' % (mode, frames, seconds, frames / seconds, args.duration / seconds, baseline / seconds))
+		print("")
+	finally:
+		if args.keep:
+			print('Kept clip and frames in ' + folder)
+		else:
+			shutil.rmtree(folder)
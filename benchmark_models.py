@@ -0,0 +1,136 @@
+import os
+import time
+import random
+import argparse
+import numpy
+
+from frame_decoder import decode_images
+from file_scanner import scan_files, scan_paths
+from file_sampling import reservoir_sample
+from labeler_models import load_selected_models, load_trunk
+
+parser = argparse.ArgumentParser(description='Compare cleaned models with their weight quantized copies (synopsis_model_cleaner.py --quantize) on a reference image set: model size, load time, latency and label agreement')
+parser.add_argument('-i', '--imagedir', type=str, help="folder of reference images", required=True)
+parser.add_argument('-m', '--modeldir', type=str, help='folder containing the full precision models', default='./Models/Classifiers/Cleaned/', required=False)
+parser.add_argument('-tr', '--trunk', type=str, help="full precision feature extractor, if modeldir contains classifier heads", default="", required=False)
+parser.add_argument('-q', '--quantized', type=str, help="comma separated folders of quantized models to compare, for example Models/Classifiers/Cleaned/Quantized/8bit", required=True)
+parser.add_argument('-qt', '--quantized-trunks', type=str, help="comma separated feature extractors, one per --quantized folder. a blank entry reuses --trunk", default="", required=False)
+parser.add_argument('-l', '--limit', type=int, help="number of reference images, sampled at random from imagedir", default=200, required=False)
+parser.add_argument('-s', '--seed', type=int, help="random seed for the reference image sample", default=0, required=False)
+parser.add_argument('-b', '--batch-size', type=int, help="number of images sent to each model in a single batched predict call", default=32, required=False)
+parser.add_argument('-ms', '--models', type=str, help="comma separated model names or glob patterns to benchmark, defaults to every model in modeldir", default="", required=False)
+parser.add_argument('-be', '--backend', type=str, help="auto, coreml, onnx or numpy. auto prefers numpy heads, then coreml on macOS or onnx elsewhere", default="auto", required=False)
+
+Height = 224 # use the correct input image height
+Width = 224 # use the correct input image width
+
+
+# bytes on disk, compiled Core ML models are folders
+def model_size(path):
+	if not os.path.isdir(path):
+		return os.path.getsize(path)
+
+	return sum(size for filepath, size, mtime in scan_files(path, skip_hidden=False))
+
+# load a folder of models (and its trunk) and score every batch, timing each model.
+# models only compile when they first predict, so the first batch counts towards a model's load time rather than its latency
+def run_variant(models_path, trunk_path, batches):
+	start = time.time()
+	try:
+		models = load_selected_models(models_path, args.backend, None, args.models)
+	except ValueError as error:
+		parser.error(str(error))
+	trunk = load_trunk(trunk_path) if trunk_path else None
+	loaded = time.time() - start
+
+	if trunk is None and any(model.is_head for model in models):
+		parser.error(models_path + ' contains classifier heads, pass the feature extractor they were split from')
+
+	names = ([trunk.name] if trunk is not None else []) + [model.name for model in models]
+	load = dict( (name, 0.0) for name in names )
+	seconds = dict( (name, 0.0) for name in names )
+	scores = dict( (model.name, []) for model in models )
+
+	for number, images in enumerate(batches):
+		timings = load if number == 0 else seconds
+
+		embeddings = None
+		if trunk is not None:
+			start = time.time()
+			embeddings = trunk.embed(images)
+			timings[trunk.name] += time.time() - start
+
+		for model in models:
+			start = time.time()
+			scores[model.name].append( model.predict_scores(embeddings if model.is_head else images) )
+			timings[model.name] += time.time() - start
+
+	sizes = dict( (model.name, model_size(model.path)) for model in models )
+	if trunk is not None:
+		sizes[trunk.name] = model_size(trunk.path)
+
+	labels = dict( (model.name, model.labels) for model in models )
+	scores = dict( (name, numpy.concatenate(scores[name])) for name in scores )
+
+	return names, sizes, loaded, load, seconds, labels, scores
+
+if __name__ == '__main__':
+
+	args = parser.parse_args()
+
+	if args.limit <= 0:
+		parser.error('--limit must be at least 1')
+
+	dir_path = os.getcwd()
+
+	quantized = [os.path.normpath( os.path.join(dir_path, folder.strip()) ) for folder in args.quantized.split(',') if folder.strip()]
+	quantized_trunks = [trunk.strip() for trunk in args.quantized_trunks.split(',')] if args.quantized_trunks else []
+	quantized_trunks += [''] * (len(quantized) - len(quantized_trunks))
+
+	reference_trunk = os.path.normpath( os.path.join(dir_path, args.trunk) ) if args.trunk else ''
+	variants = [('reference', os.path.normpath( os.path.join(dir_path, args.modeldir) ), reference_trunk)]
+
+	for folder, trunk in zip(quantized, quantized_trunks):
+		variants.append( (os.path.basename(folder), folder, os.path.normpath( os.path.join(dir_path, trunk) ) if trunk else reference_trunk) )
+
+	# every variant sees the same decoded images, in the same batches
+	paths = sorted(reservoir_sample(scan_paths(args.imagedir, ['.jpg', '.jpeg', '.png']), args.limit, random.Random(args.seed)))
+	images = [image for filepath, image in decode_images(paths, resize_to=(Width, Height)) if image is not None]
+
+	if len(images) <= args.batch_size:
+		parser.error('need more than one batch of reference images to time, lower --batch-size or add images')
+
+	batches = [images[start:start + args.batch_size] for start in range(0, len(images), args.batch_size)]
+	timed = len(images) - len(batches[0])
+
+	print('Benchmarking ' + str(len(variants)) + ' model folders on ' + str(len(images)) + ' images from ' + args.imagedir)
+
+	results = [run_variant(models_path, trunk_path, batches) for name, models_path, trunk_path in variants]
+	reference_labels = results[0][5]
+	reference_scores = results[0][6]
+
+	print("")
+	print('%-12s %-44s %9s %8s %10s %10s %10s' % ('variant', 'model', 'size MB', 'load s', 'ms/image', 'agreement', 'max diff'))
+
+	for (variant, models_path, trunk_path), (names, sizes, loaded, load, seconds, labels, scores) in zip(variants, results):
+		agreements = []
+
+		for name in names:
+			agreement = ''
+			difference = ''
+
+			# label agreement is how often the quantized model picks the same top label as the full precision one
+			if variant != 'reference' and name in scores and name in reference_scores:
+				if labels[name] != reference_labels[name]:
+					agreement = 'labels differ'
+				else:
+					same = numpy.argmax(scores[name], axis=1) == numpy.argmax(reference_scores[name], axis=1)
+					agreements.append(same.mean())
+					agreement = '%.2f%%' % (100.0 * same.mean())
+					difference = '%.4f' % numpy.abs(scores[name] - reference_scores[name]).max()
+
+			print('%-12s %-44s %9.2f %8.2f %10.2f %10s %10s' % (variant, name, sizes[name] / 1e6, load[name], 1000.0 * seconds[name] / timed, agreement, difference))
+
+		total = '%.2f%%' % (100.0 * numpy.mean(agreements)) if agreements else ''
+		print('%-12s %-44s %9.2f %8.2f %10.2f %10s' % (variant, 'total', sum(sizes.values()) / 1e6, loaded + sum(load.values()), 1000.0 * sum(seconds.values()) / timed, total))
+		print("")
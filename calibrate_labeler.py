@@ -0,0 +1,126 @@
+import os
+import argparse
+import time
+import numpy
+
+from frame_decoder import SKIPPED, decode_images
+from embedding_cache import EmbeddingCache
+from label_matrix import LabelVocabulary
+from label_calibration import calibrate, read_labeled_csv, save_thresholds, truth_matrix
+from model_cache import ModelCache
+from labeler_models import load_selected_models, load_trunk, predict_matrix
+
+parser = argparse.ArgumentParser(description='Calibrate a per label score threshold for multi label auto labeling from a held out labeled data set')
+parser.add_argument('-m', '--modeldir', type=str, help='folder containing the models auto_labeler.py will label with', default='./Models/Classifiers/Cleaned/', required=False)
+parser.add_argument('-i', '--labels', type=str, help="held out multi label csv of path,label1,label2... in the AutoML format auto_labeler.py writes", required=True)
+parser.add_argument('-pre', '--prefix', type=str, help="url prefix to strip from the csv paths to find the local images, for example a cloud storage bucket", default="", required=False)
+parser.add_argument('-o', '--output', type=str, help="destination calibration json, pass it to auto_labeler.py --thresholds", default="./thresholds.json", required=False)
+parser.add_argument('-tp', '--target-precision', type=float, help="precision each label should reach on the held out set, we pick the threshold with the best recall that does", default=0.9, required=False)
+parser.add_argument('-b', '--batch-size', type=int, help="number of images sent to each model in a single batched predict call", default=32, required=False)
+parser.add_argument('-dw', '--decode-workers', type=int, help="number of workers decoding and resizing images ahead of inference, 0 decodes inline", default=0, required=False)
+parser.add_argument('-c', '--cache', type=str, help="sqlite file caching embeddings and predictions by image content, shared with auto_labeler.py", default="", required=False)
+parser.add_argument('-tr', '--trunk', type=str, help="shared feature extractor model (.mlmodel or .onnx), run once per image to feed the classifier heads in modeldir", default="", required=False)
+parser.add_argument('-ms', '--models', type=str, help="comma separated model names or glob patterns to label with, for example shot.angle,shot.framing. defaults to every model in modeldir", default="", required=False)
+parser.add_argument('-mc', '--model-cache', type=str, help="folder caching compiled models and their descriptions by model file hash, shared between runs to cut startup time", default="", required=False)
+parser.add_argument('-be', '--backend', type=str, help="auto, coreml, onnx or numpy. auto prefers numpy heads, then coreml on macOS or onnx elsewhere", default="auto", required=False)
+
+Height = 224 # use the correct input image height
+Width = 224 # use the correct input image width
+
+
+if __name__ == '__main__':
+
+	args = parser.parse_args()
+
+	dir_path = os.getcwd()
+	models_path = os.path.normpath( os.path.join(dir_path, args.modeldir) )
+
+	print('Loading Models from: ' + models_path)
+
+	model_cache = None
+	if args.model_cache:
+		model_cache = ModelCache(args.model_cache)
+
+	try:
+		models = load_selected_models(models_path, args.backend, model_cache, args.models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	try:
+		vocabulary = LabelVocabulary(models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	trunk = None
+	if args.trunk:
+		trunk = load_trunk(os.path.normpath( os.path.join(dir_path, args.trunk) ), cache=model_cache)
+	elif any(model.is_head for model in models):
+		parser.error('modeldir contains classifier heads, pass --trunk with the feature extractor they were split from')
+
+	cache = None
+	skip = None
+	if args.cache:
+		cache = EmbeddingCache(args.cache)
+
+		# unreadable paths are not cached, the decoder skips them like it does without a cache
+		def skip(filepath):
+			try:
+				return cache.has_scores(cache.image_key(filepath), models, trunk)
+			except OSError:
+				return False
+
+	paths, labels = read_labeled_csv(args.labels, args.prefix)
+
+	start = time.time()
+
+	# score every held out image into one matrix, in batches
+	matrices = []
+	labeled = []
+	batch = []
+
+	def score(batch):
+		images = [None if image is SKIPPED else image for index, image in batch]
+		keys = [cache.image_key(paths[index]) for index, image in batch] if cache is not None else None
+		matrices.append( predict_matrix(models, vocabulary, images, trunk, cache, keys) )
+		labeled.extend([index for index, image in batch])
+
+	positions = dict( (path, index) for index, path in enumerate(paths) )
+
+	for filepath, image in decode_images(paths, resize_to=(Width, Height), workers=args.decode_workers, skip=skip):
+		# images we could not read are left out of the calibration
+		if image is None:
+			continue
+
+		batch.append((positions[filepath], image))
+
+		if len(batch) >= args.batch_size:
+			score(batch)
+			batch = []
+
+	if batch:
+		score(batch)
+
+	if cache is not None:
+		cache.close()
+
+	if not labeled:
+		parser.error('none of the images in ' + args.labels + ' could be read')
+
+	matrix = numpy.concatenate(matrices)
+	truth = truth_matrix(vocabulary, [labels[index] for index in labeled])
+
+	thresholds, precision, recall = calibrate(matrix, truth, args.target_precision)
+	save_thresholds(args.output, vocabulary, args.target_precision, thresholds, precision, recall, len(labeled))
+
+	print("")
+	print( str(len(labeled)) + " images scored in " + str(time.time() - start) + " seconds")
+	print("")
+
+	for column, label in enumerate(vocabulary.labels):
+		if numpy.isfinite(thresholds[column]):
+			print( label + ": threshold " + ('%.4f' % thresholds[column]) + ", precision " + ('%.3f' % precision[column]) + ", recall " + ('%.3f' % recall[column]) )
+		else:
+			print( label + ": never reaches " + str(args.target_precision) + " precision, it will not be emitted" )
+
+	print("")
+	print("Wrote thresholds to " + args.output)
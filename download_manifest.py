@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+
+from image_fetcher import image_filename, write_atomic
+
+# the persistent state of synopsis_categories_and_concepts_image_downloader.py, so a re-run
+# only searches for new concepts or search terms and only fetches the images a concept is missing.
+#
+# {"concepts": {"<category>/<concept>": {
+#     "category": ..., "concept": ..., "target": 300,
+#     "status": "complete" | "incomplete" | "exhausted" (searched, but every url has been tried),
+#     "search_terms": [terms we have collected urls for],
+#     "urls": [every url in the order search returned them],
+#     "images": {url: {"file": name, "status": "downloaded" | "failed" | "duplicate" | "removed", "sha1": ..., "error": ...}}
+# }}}
+#
+# urls without an entry in images have not been fetched yet.
+
+DOWNLOADED = 'downloaded'
+FAILED = 'failed'
+DUPLICATE = 'duplicate'
+REMOVED = 'removed'
+
+
+def file_sha1(path):
+	digest = hashlib.sha1()
+
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+class DownloadManifest(object):
+
+	def __init__(self, path, output):
+		self.path = path
+		self.output = output
+		self.concepts = {}
+
+		if os.path.exists(path):
+			with open(path) as f:
+				self.concepts = json.load(f)['concepts']
+
+	def save(self):
+		write_atomic(self.path, json.dumps({'concepts': self.concepts}, indent=1, sort_keys=True).encode('utf-8'))
+
+	# the manifest entry of a concept, created for new concepts
+	def concept(self, category, concept, target):
+		key = category + '/' + concept
+		entry = self.concepts.get(key)
+
+		if entry is None:
+			entry = {'category': category, 'concept': concept, 'search_terms': [], 'urls': [], 'images': {}, 'status': 'incomplete'}
+			self.concepts[key] = entry
+
+		entry['target'] = target
+
+		return entry
+
+	def folder(self, entry):
+		return os.path.join(self.output, entry['category'], entry['concept'])
+
+	def destination(self, entry, url):
+		return os.path.join(self.folder(entry), image_filename(url))
+
+	# search terms we have not collected urls for yet, new concepts have all of them
+	def new_search_terms(self, entry, search_terms):
+		return [term for term in search_terms if term not in entry['search_terms']]
+
+	def add_urls(self, entry, search_terms, urls):
+		known = set(entry['urls'])
+		for url in urls:
+			if url not in known:
+				known.add(url)
+				entry['urls'].append(url)
+
+		for term in search_terms:
+			if term not in entry['search_terms']:
+				entry['search_terms'].append(term)
+
+		# more urls may be what an exhausted concept was waiting for
+		if entry['status'] == 'exhausted':
+			entry['status'] = 'incomplete'
+
+	# how many images a concept has on disk. images deleted since we fetched them
+	# (say by find_duplicates.py --remove) no longer count, and are not fetched again
+	def downloaded(self, entry):
+		count = 0
+
+		for url, image in entry['images'].items():
+			if image['status'] != DOWNLOADED:
+				continue
+
+			if os.path.exists(os.path.join(self.folder(entry), image['file'])):
+				count += 1
+			else:
+				image['status'] = REMOVED
+
+		return count
+
+	def needed(self, entry):
+		return max(entry['target'] - self.downloaded(entry), 0)
+
+	# the next count urls we have not tried yet, in search order
+	def pending(self, entry, count):
+		urls = []
+
+		for url in entry['urls']:
+			if len(urls) >= count:
+				break
+			if url not in entry['images']:
+				urls.append(url)
+
+		return urls
+
+	def retry_failed(self, entry):
+		for url in list(entry['images']):
+			if entry['images'][url]['status'] == FAILED:
+				del entry['images'][url]
+
+	# record a fetch result, returning the status we recorded. byte identical images are only kept once per concept
+	def record(self, entry, url, status):
+		name = image_filename(url)
+
+		if status not in (DOWNLOADED, 'exists'):
+			entry['images'][url] = {'file': name, 'status': FAILED, 'error': status}
+			return FAILED
+
+		path = os.path.join(self.folder(entry), name)
+		sha1 = file_sha1(path)
+
+		for other_url, image in entry['images'].items():
+			if other_url != url and image.get('sha1') == sha1 and image['status'] == DOWNLOADED:
+				os.remove(path)
+				entry['images'][url] = {'file': name, 'status': DUPLICATE, 'sha1': sha1}
+				return DUPLICATE
+
+		entry['images'][url] = {'file': name, 'status': DOWNLOADED, 'sha1': sha1}
+		return DOWNLOADED
+
+	def update_status(self, entry):
+		if self.downloaded(entry) >= entry['target']:
+			entry['status'] = 'complete'
+		elif entry['search_terms'] and not self.pending(entry, 1):
+			entry['status'] = 'exhausted'
+		else:
+			entry['status'] = 'incomplete'
+
+		return entry['status']
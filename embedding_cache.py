@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import hashlib
+import numpy
+
+
+def file_digest(path):
+	digest = hashlib.sha1()
+
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+# content addressed store of trunk embeddings and per model score vectors.
+# images are keyed by a hash of their bytes (packed frames by a hash of their pixels) and models by a hash of their model file,
+# classifier heads by the hashes of both the head and the trunk whose embeddings they scored,
+# so a re-run only computes the (image, model) pairs that changed or are new.
+class EmbeddingCache(object):
+
+	def __init__(self, path):
+		self.db = sqlite3.connect(path, timeout=60)
+		self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS embeddings (hash TEXT, version TEXT, vector BLOB, PRIMARY KEY (hash, version))')
+		self.db.execute('CREATE TABLE IF NOT EXISTS scores (hash TEXT, version TEXT, vector BLOB, PRIMARY KEY (hash, version))')
+		self.db.commit()
+
+		self.versions = {}
+
+	def close(self):
+		self.db.commit()
+		self.db.close()
+
+	# hashing millions of images every run would defeat the point,
+	# so we only re-hash files whose size or modification time changed since we last saw them
+	def image_key(self, path):
+		stat = os.stat(path)
+
+		row = self.db.execute('SELECT size, mtime, hash FROM files WHERE path = ?', (path,)).fetchone()
+		if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+			return row[2]
+
+		key = file_digest(path)
+		self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime, key))
+		return key
+
+	# frames from a packed frame set are keyed by their pixels, the originals they were packed from may be gone.
+	# these are the pixels our models see, so nothing is hashed or even opened outside the pack
+	def frame_key(self, frame):
+		digest = hashlib.sha1(str(frame.shape).encode('ascii'))
+		digest.update(numpy.ascontiguousarray(frame).data)
+		return digest.hexdigest()
+
+	def model_version(self, model):
+		if model.path not in self.versions:
+			self.versions[model.path] = file_digest(model.path)
+
+		return self.versions[model.path]
+
+	# a head's scores are only as current as the embeddings it scored, so they depend on the trunk too
+	def score_version(self, model, trunk=None):
+		if model.is_head and trunk is not None:
+			return self.model_version(model) + '+' + self.model_version(trunk)
+
+		return self.model_version(model)
+
+	def has_scores(self, key, models, trunk=None):
+		for model in models:
+			row = self.db.execute('SELECT 1 FROM scores WHERE hash = ? AND version = ?', (key, self.score_version(model, trunk))).fetchone()
+			if row is None:
+				return False
+
+		return True
+
+	# returns a float32 score vector in the models label order, or None if we have not seen this image / model pair yet
+	def get_scores(self, model, keys, trunk=None):
+		version = self.score_version(model, trunk)
+		scores = []
+
+		for key in keys:
+			row = self.db.execute('SELECT vector FROM scores WHERE hash = ? AND version = ?', (key, version)).fetchone()
+			if row is None:
+				scores.append(None)
+			else:
+				scores.append(numpy.frombuffer(row[0], dtype=numpy.float32))
+
+		return scores
+
+	def put_scores(self, model, keys, scores, trunk=None):
+		version = self.score_version(model, trunk)
+		rows = [(key, version, numpy.asarray(vector, dtype=numpy.float32).tobytes()) for key, vector in zip(keys, scores)]
+		self.db.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?)', rows)
+
+	def get_embeddings(self, trunk, keys):
+		version = self.model_version(trunk)
+		embeddings = []
+
+		for key in keys:
+			row = self.db.execute('SELECT vector FROM embeddings WHERE hash = ? AND version = ?', (key, version)).fetchone()
+			if row is None:
+				embeddings.append(None)
+			else:
+				embeddings.append(numpy.frombuffer(row[0], dtype=numpy.float32))
+
+		return embeddings
+
+	def put_embeddings(self, trunk, keys, embeddings):
+		version = self.model_version(trunk)
+		rows = [(key, version, numpy.asarray(embedding, dtype=numpy.float32).tobytes()) for key, embedding in zip(keys, embeddings)]
+		self.db.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)', rows)
+
+	def commit(self):
+		self.db.commit()
@@ -1,30 +1,314 @@
 import os
 import sys
+import csv
+import math
+import time
+import argparse
 import subprocess
-from subprocess import Popen
 from multiprocessing import Pool
 
-p = Pool(8)
-input_dir = sys.argv[1]
-output_dir = sys.argv[2]
-extension = sys.argv[3]
+from file_scanner import scan_paths
 
-def processFile(filename):
-	if filename.endswith(extension):
-		current_file = os.path.join(root, filename)
-		destination = os.path.join(output_dir, filename)
-		destination = os.path.splitext(destination)[0]+'_%04d.jpg'
+parser = argparse.ArgumentParser(description='Extract frames from every video in a folder with ffmpeg')
+parser.add_argument('input_dir', type=str, help='folder to scan for videos')
+parser.add_argument('output_dir', type=str, help='folder to write extracted frames to')
+parser.add_argument('extension', type=str, help='extension of the videos to extract frames from, comma separated for several, matched case insensitively')
+parser.add_argument('-m', '--mode', type=str, help="fixed: one frame every --interval seconds. scene: one frame per detected shot", default="fixed", required=False)
+parser.add_argument('-n', '--interval', type=float, help="seconds between frames in fixed mode", default=3.0, required=False)
+parser.add_argument('-d', '--decode', type=str, help="fixed mode decoding. full: decode every frame. keyframes: only decode keyframes (-skip_frame nokey), at most one per interval. seek: seek to each sample time and decode from the nearest keyframe, which pays off when the interval is longer than the GOP", default="full", required=False)
+parser.add_argument('-mw', '--max-width', type=int, help="downscale frames wider than this as the first filter after decode, eg for 4K masters. 0 keeps the source size", default=0, required=False)
+parser.add_argument('-st', '--scene-threshold', type=float, help="ffmpeg scene score (0-1) above which we consider a frame a cut", default=0.3, required=False)
+parser.add_argument('-mi', '--min-interval', type=float, help="scene mode: shots shorter than this many seconds are merged into the previous shot", default=1.0, required=False)
+parser.add_argument('-mx', '--max-interval', type=float, help="scene mode: shots longer than this many seconds are split so we sample at least this often", default=10.0, required=False)
+parser.add_argument('-w', '--workers', type=int, help="number of videos extracted at once", default=os.cpu_count(), required=False)
+parser.add_argument('-th', '--threads', type=int, help="threads per ffmpeg job, defaults to cores / workers so our jobs dont oversubscribe the machine", default=0, required=False)
+parser.add_argument('-to', '--timeout', type=float, help="seconds before we give up on a video, across every ffmpeg job it takes, 0 waits forever", default=0, required=False)
+parser.add_argument('-rt', '--retries', type=int, help="number of times we retry a video that failed or timed out", default=1, required=False)
+parser.add_argument('-sw', '--scan-workers', type=int, help="threads listing input_dir's folders at once, which pays off on network file systems", default=8, required=False)
+parser.add_argument('-fi', '--file-index', type=str, help="sqlite file indexing input_dir's folders, so later runs only list folders that changed", default="", required=False)
+parser.add_argument('-ow', '--overwrite', type=bool, help="extract videos again even if they already have output", default=False, required=False)
 
+args = parser.parse_args()
+
+input_dir = args.input_dir
+output_dir = args.output_dir
+extension = args.extension
+
+threads = args.threads
+if threads <= 0:
+	threads = max(1, os.cpu_count() // max(1, args.workers))
+
+# returned instead of an exit code when ffmpeg ran past our timeout
+TIMED_OUT = 'timeout'
+
+def ffmpegCommand(current_file, options, seek=None, keyframes=False):
+	command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-threads", str(threads), "-filter_threads", str(threads)]
+
+	# have the decoder drop everything but keyframes before doing any work on them
+	if keyframes:
+		command += ["-skip_frame", "nokey"]
+
+	if seek is not None:
+		command += ["-ss", str(seek)]
+
+	return command + ["-i", str(current_file)] + options
+
+# filters for our frames, downscaling large sources before anything else touches them
+def videoFilters(filters):
+	if args.max_width > 0:
+		filters = ["scale='min(iw," + str(args.max_width) + ")':-2"] + filters
+
+	return filters
+
+# every attempt at a video gets one deadline, however many ffmpeg jobs it takes
+def startDeadline():
+	return time.time() + args.timeout if args.timeout else None
+
+# seconds left before our deadline, None waits forever
+def remaining(deadline):
+	if deadline is None:
+		return None
+
+	return max(0.0, deadline - time.time())
+
+def runFFmpeg(command, deadline):
+	if deadline is not None and remaining(deadline) <= 0:
+		return TIMED_OUT
+
+	process = subprocess.Popen(command)
+
+	try:
+		return process.wait(timeout=remaining(deadline))
+	except subprocess.TimeoutExpired:
+		process.kill()
+		process.wait()
+		return TIMED_OUT
+
+def parseDuration(log):
+	for line in log.splitlines():
+		if line.strip().startswith('Duration:') and 'N/A' not in line:
+			hours, minutes, seconds = line.split('Duration:')[1].split(',')[0].strip().split(':')
+			return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+	return 0.0
+
+# ffmpeg with no output fails, but not before printing the duration of its input
+def probeDuration(current_file, deadline):
+	result = subprocess.run(["ffmpeg", "-hide_banner", "-i", str(current_file)], stderr=subprocess.PIPE, universal_newlines=True, timeout=remaining(deadline))
+	return parseDuration(result.stderr)
+
+# grab a single frame at each timestamp by seeking to it, rather than decoding everything in between
+def extractAt(current_file, timestamps, destination, deadline):
+	for i in range(len(timestamps)):
+		code = runFFmpeg(ffmpegCommand(current_file, ["-vf", ",".join(videoFilters(["null"])), "-frames:v", "1", "-q:v", "2", "-y", str(destination % (i + 1))], seek=timestamps[i]), deadline)
+		if code != 0:
+			return code
+
+	return 0
+
+# find our cuts with ffmpeg's scene score on a small copy of every frame.
+# returns the timestamps of every cut and the duration of the video
+def detectCuts(current_file, deadline):
+	command = ffmpegCommand(current_file, ["-an",
+		"-vf", "scale=160:-2,select='gt(scene," + str(args.scene_threshold) + ")',showinfo",
+		"-f", "null", "-"])
+
+	# showinfo and the duration are logged at info level
+	command[command.index("-loglevel") + 1] = "info"
+
+	result = subprocess.run(command, stderr=subprocess.PIPE, universal_newlines=True, timeout=remaining(deadline))
+
+	cuts = []
+
+	for line in result.stderr.splitlines():
+		if 'Parsed_showinfo' in line and 'pts_time:' in line:
+			cuts.append( float(line.split('pts_time:')[1].split()[0]) )
+
+	duration = parseDuration(result.stderr)
+
+	# the last frame we sampled is a lower bound if ffmpeg could not tell us the duration
+	if cuts:
+		duration = max(duration, cuts[-1])
+
+	return cuts, duration
+
+# turn our cuts into (start, end) shots, respecting our min and max shot lengths
+def shotsFromCuts(cuts, duration):
+	boundaries = [0.0] + [cut for cut in cuts if 0.0 < cut < duration] + [duration]
+
+	shots = []
+	for i in range(len(boundaries) - 1):
+		start = boundaries[i]
+		end = boundaries[i + 1]
+
+		# too close to the previous cut, probably a flash or a fast pan rather than a new shot
+		if shots and end - start < args.min_interval:
+			shots[-1] = (shots[-1][0], end)
+		else:
+			shots.append( (start, end) )
+
+	# long takes get a frame at least every max_interval seconds
+	split = []
+	for start, end in shots:
+		parts = max(1, int(math.ceil( (end - start) / args.max_interval )))
+		length = (end - start) / parts
+		for part in range(parts):
+			split.append( (start + part * length, start + (part + 1) * length) )
+
+	return split
+
+def manifestPath(destination):
+	return destination.replace('_%04d.jpg', '_shots.csv')
+
+# fixed mode's list of the frames we extracted
+def framesPath(destination):
+	return destination.replace('_%04d.jpg', '_frames.txt')
+
+# written last, so it only exists for videos we finished
+def donePath(destination):
+	if args.mode == 'scene':
+		return manifestPath(destination)
+
+	return framesPath(destination)
+
+# one frame from the middle of every shot, plus a manifest of our shot boundaries.
+# the manifest is written last, so it only exists for videos we finished
+def extractShots(current_file, destination, deadline):
+	try:
+		cuts, duration = detectCuts(current_file, deadline)
+	except subprocess.TimeoutExpired:
+		return TIMED_OUT
+
+	shots = shotsFromCuts(cuts, duration)
+	timestamps = [(start + end) / 2.0 for start, end in shots]
+
+	code = extractAt(current_file, timestamps, destination, deadline)
+	if code != 0:
+		return code
+
+	rows = []
+	for i in range(len(shots)):
+		start, end = shots[i]
+		rows.append([i + 1, '%.3f' % start, '%.3f' % end, '%.3f' % timestamps[i], os.path.basename(destination % (i + 1))])
+
+	with open(manifestPath(destination), 'w', newline='') as manifest:
+		writer = csv.writer(manifest)
+		writer.writerow(['shot', 'start', 'end', 'timestamp', 'frame'])
+		writer.writerows(rows)
+
+	return 0
+
+# frames every interval seconds, then the list of frames we wrote, like the manifest of scene mode
+def extractFixed(current_file, destination, deadline):
+	code = extractFixedFrames(current_file, destination, deadline)
+	if code != 0:
+		return code
+
+	with open(framesPath(destination), 'w') as frames:
+		for filename in outputFrames(destination):
+			frames.write(filename + '\n')
+
+	return 0
+
+def extractFixedFrames(current_file, destination, deadline):
+	# long GOP sources: only keyframes get decoded, and we keep at most one every interval
+	if args.decode == 'keyframes':
+		select = "select='isnan(prev_selected_t)+gte(t-prev_selected_t," + str(args.interval) + ")'"
+		return runFFmpeg(ffmpegCommand(current_file, ["-vf", ",".join(videoFilters([select])), "-fps_mode", "vfr", "-q:v", "2", "-y", str(destination)], keyframes=True), deadline)
+
+	if args.decode == 'seek':
+		try:
+			duration = probeDuration(current_file, deadline)
+		except subprocess.TimeoutExpired:
+			return TIMED_OUT
+
+		timestamps = [i * args.interval for i in range(int(math.ceil(duration / args.interval)))]
+		return extractAt(current_file, timestamps, destination, deadline)
+
+	return runFFmpeg(ffmpegCommand(current_file, ["-vf", ",".join(videoFilters(["fps=1/" + str(args.interval)])), "-q:v", "2", "-y", str(destination)]), deadline)
+
+# a video is only done once its marker exists, frames alone may be left over from a run that was killed
+def hasOutput(destination):
+	return os.path.exists(donePath(destination))
+
+# the frames we have written for a video, in order
+def outputFrames(destination):
+	prefix = os.path.basename(destination).replace('%04d.jpg', '')
+	folder = os.path.dirname(destination)
+
+	return sorted(filename for filename in os.listdir(folder) if filename.startswith(prefix) and filename.endswith('.jpg') and filename[len(prefix):-4].isdigit())
+
+# remove whatever a failed or timed out job left behind, so it is not mistaken for finished output
+def removeOutput(destination):
+	folder = os.path.dirname(destination)
+
+	for filename in outputFrames(destination):
+		os.remove(os.path.join(folder, filename))
+
+# returns (file, status, exit code) where status is one of done, skipped, failed
+def processFile(current_file):
+	# mirror the video's folder under output_dir, so videos with the same name in different folders never share frames
+	relative = os.path.relpath(current_file, input_dir)
+	destination = os.path.join(output_dir, os.path.splitext(relative)[0] + '_%04d.jpg')
+
+	folder = os.path.dirname(destination)
+	if not os.path.exists(folder):
+		os.makedirs(folder, exist_ok=True)
+
+	if not args.overwrite and hasOutput(destination):
+		print('skipping ' + current_file + ', already extracted')
+		return current_file, 'skipped', 0
+
+	# we are extracting again, so an old marker must not vouch for frames we have not finished
+	if os.path.exists(donePath(destination)):
+		os.remove(donePath(destination))
+
+	code = None
+	for attempt in range(args.retries + 1):
 		print('processing :' + current_file)
 		print('to ' + destination)
-		return subprocess.Popen(["ffmpeg", "-i", str(current_file),  "-vf", "fps=1/3", "-q:v 2" str(destination), "-hide_banner"]).wait()
 
-print('scanning ' + input_dir + ' for files with extension ' + extension)
-print('outputing to ' + output_dir)
+		deadline = startDeadline()
+
+		if args.mode == 'scene':
+			code = extractShots(current_file, destination, deadline)
+		else:
+			code = extractFixed(current_file, destination, deadline)
+
+		if code == 0:
+			return current_file, 'done', 0
+
+		removeOutput(destination)
+		print('failed ' + current_file + ' (' + str(code) + '), attempt ' + str(attempt + 1) + ' of ' + str(args.retries + 1))
+
+	return current_file, 'failed', code
+
+# streams videos to our workers as the scan finds them, so extraction starts before a big archive is fully listed
+def listFiles():
+	extensions = [e.strip() for e in extension.split(',') if e.strip()]
+	return scan_paths(input_dir, extensions, workers=args.scan_workers, index=args.file_index or None)
+
+if __name__ == '__main__':
+
+	print('scanning ' + input_dir + ' for files with extension ' + extension)
+	print('outputing to ' + output_dir)
+	print(str(args.workers) + ' workers with ' + str(threads) + ' ffmpeg threads each')
+
+	videos = listFiles()
+
+	summary = {'done': 0, 'skipped': 0, 'failed': 0}
+	failures = []
+
+	with Pool(args.workers) as pool:
+		for current_file, status, code in pool.imap_unordered(processFile, videos):
+			summary[status] += 1
+			if status == 'failed':
+				failures.append( (current_file, code) )
+
+	print("")
+	print(str(sum(summary.values())) + ' videos: ' + str(summary['done']) + ' extracted, ' + str(summary['skipped']) + ' skipped, ' + str(summary['failed']) + ' failed')
 
-for root, subdirs, files in os.walk(input_dir):
-	files = [f for f in files if not f[0] == '.']
-	subdirs[:] = [d for d in subdirs if not d[0] == '.']
+	for current_file, code in failures:
+		print('failed: ' + current_file + ' (exit code ' + str(code) + ')')
 
-	for filename in files:
-		processFile(filename)
\ No newline at end of file
+	sys.exit(1 if failures else 0)
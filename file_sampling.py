@@ -0,0 +1,128 @@
+import os
+import math
+import heapq
+import itertools
+import collections
+
+# seeded random samples of a stream of paths, for quick test runs over trees too big to list and shuffle.
+# both samplers take one pass and hold about k paths, whatever the length of the stream,
+# and return the sample shuffled. the same seed and the same stream give the same sample,
+# which is what lets every labeler shard agree on the sample without talking to each other.
+
+
+def uniform(rng):
+	value = rng.random()
+	while value == 0.0:
+		value = rng.random()
+
+	return value
+
+def skip(iterator, count):
+	collections.deque(itertools.islice(iterator, count), maxlen=0)
+
+# a uniform sample of k items (Li's algorithm L). rather than drawing a random number per item,
+# it draws how many items to skip before the next replacement, so most of the stream is just iterated
+def reservoir_sample(items, k, rng):
+	items = iter(items)
+
+	if k is None:
+		reservoir = list(items)
+		rng.shuffle(reservoir)
+		return reservoir
+
+	if k <= 0:
+		return []
+
+	reservoir = list(itertools.islice(items, k))
+
+	if len(reservoir) == k and k > 0:
+		weight = math.exp(math.log(uniform(rng)) / k)
+		done = object()
+
+		while True:
+			skip(items, int(math.log(uniform(rng)) / math.log(1.0 - weight)))
+
+			item = next(items, done)
+			if item is done:
+				break
+
+			reservoir[rng.randrange(k)] = item
+			weight *= math.exp(math.log(uniform(rng)) / k)
+
+	rng.shuffle(reservoir)
+	return reservoir
+
+# the smallest per stratum share with which sampling min(count, share) items from every stratum gives us k,
+# strata with fewer items than that give all of theirs
+def water_level(counts, k):
+	low, high = 1, max(counts)
+
+	if sum(counts) <= k:
+		return high
+
+	while low < high:
+		middle = (low + high) // 2
+		if sum(min(count, middle) for count in counts) >= k:
+			high = middle
+		else:
+			low = middle + 1
+
+	return low
+
+# a sample of k items spread as evenly as possible across strata, by default the folder each path is in,
+# so every concept or source video is represented rather than the largest ones dominating.
+# every item gets a random key and each stratum keeps its smallest keys, up to the current water level.
+# the level only ever drops as the stream goes on, so what we drop is never needed later
+def stratified_sample(items, k, rng, stratum=os.path.dirname):
+	if k is None:
+		return reservoir_sample(items, None, rng)
+
+	if k <= 0:
+		return []
+
+	counts = {}
+	heaps = {}
+	level = k
+	held = 0
+
+	for position, item in enumerate(items):
+		name = stratum(item)
+		counts[name] = counts.get(name, 0) + 1
+		heap = heaps.setdefault(name, [])
+
+		# max heaps of the smallest keys, (-key, position, item) so items themselves are never compared
+		key = rng.random()
+		if len(heap) < level:
+			heapq.heappush(heap, (-key, position, item))
+			held += 1
+		elif key < -heap[0][0]:
+			heapq.heapreplace(heap, (-key, position, item))
+
+		if held > 2 * (k + len(heaps)):
+			level = water_level(list(counts.values()), k)
+
+			for heap in heaps.values():
+				while len(heap) > level:
+					heapq.heappop(heap)
+					held -= 1
+
+	if not counts:
+		return []
+
+	level = water_level(list(counts.values()), k)
+
+	# every stratum gives up to level - 1 items, then strata with items to spare give one more each until we have k
+	sample = []
+	spare = []
+
+	for name in counts:
+		smallest = [entry[2] for entry in sorted(heaps[name], reverse=True)]
+		sample.extend(smallest[:level - 1])
+
+		if len(smallest) >= level:
+			spare.append(smallest[level - 1])
+
+	sample.extend(rng.sample(spare, min(k - len(sample), len(spare))))
+
+	rng.shuffle(sample)
+	return sample
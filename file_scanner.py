@@ -0,0 +1,141 @@
+import os
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+# a shared directory scanner for our image, video and model folders.
+# directories are listed with os.scandir on a pool of threads, running ahead of the consumer,
+# while (path, size, mtime) tuples stream out in a stable order: the files of a directory sorted by name,
+# then each of its subdirectories in name order. on network file systems the listing latency,
+# not the work, is what makes a walk slow, so listing many directories at once is what helps.
+#
+# with an index (a sqlite file) we remember every directory's mtime and listing.
+# adding, removing or renaming entries changes a directory's mtime, so on the next scan
+# directories whose mtime is unchanged are not listed again, which costs one stat each rather than
+# a listing and a stat per file. files rewritten in place keep their old size and mtime in the index.
+
+
+class FileIndex(object):
+
+	def __init__(self, path):
+		self.db = sqlite3.connect(path, timeout=60)
+		self.db.execute('CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime REAL, files TEXT, subdirs TEXT)')
+		self.db.commit()
+
+	def get(self, path):
+		row = self.db.execute('SELECT mtime, files, subdirs FROM directories WHERE path = ?', (path,)).fetchone()
+		if row is None:
+			return None
+
+		return row[0], json.loads(row[1]), json.loads(row[2])
+
+	def put(self, path, mtime, files, subdirs):
+		self.db.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)', (path, mtime, json.dumps(files), json.dumps(subdirs)))
+
+	def commit(self):
+		self.db.commit()
+
+	def close(self):
+		self.db.commit()
+		self.db.close()
+
+
+# list a single directory, returning (mtime, [(name, size, mtime)], [subdirectory names], listed)
+# or reusing our cached listing if the directory has not changed since we indexed it
+def list_directory(path, cached):
+	try:
+		mtime = os.stat(path).st_mtime
+	except OSError:
+		print('Unable to scan ' + path)
+		return None, [], [], False
+
+	if cached is not None and cached[0] == mtime:
+		return mtime, cached[1], cached[2], False
+
+	files = []
+	subdirs = []
+
+	try:
+		with os.scandir(path) as entries:
+			for entry in entries:
+				try:
+					if entry.is_dir(follow_symlinks=False):
+						subdirs.append(entry.name)
+					elif entry.is_file():
+						info = entry.stat()
+						files.append((entry.name, info.st_size, info.st_mtime))
+				except OSError:
+					continue
+	except OSError:
+		print('Unable to scan ' + path)
+		return None, [], [], False
+
+	files.sort()
+	subdirs.sort()
+
+	return mtime, files, subdirs, True
+
+def wanted(name, extensions, skip_hidden):
+	if skip_hidden and name.startswith('.'):
+		return False
+
+	return extensions is None or name.lower().endswith(extensions)
+
+# yields (path, size, mtime) for every file under root whose extension is one of extensions (case insensitive, None for every file).
+# hidden files and folders (macOS ._ files and the like) are skipped unless skip_hidden is False.
+# lookahead bounds how many directories are listed ahead of the consumer
+def scan_files(root, extensions=None, recursive=True, skip_hidden=True, workers=8, index=None, lookahead=256):
+	if isinstance(extensions, str):
+		extensions = [extensions]
+	if extensions is not None:
+		extensions = tuple(extension.lower() for extension in extensions)
+
+	file_index = FileIndex(index) if index else None
+
+	def submit(executor, path):
+		cached = file_index.get(path) if file_index is not None else None
+		return executor.submit(list_directory, path, cached)
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		# directories still to emit, the next one last, each with its listing future once submitted
+		stack = [[root, None]]
+		listed_count = 0
+
+		try:
+			while stack:
+				# keep the next few directories we will emit listing in the background
+				for pending in stack[-lookahead:]:
+					if pending[1] is None:
+						pending[1] = submit(executor, pending[0])
+
+				path, future = stack.pop()
+				mtime, files, subdirs, listed = future.result()
+
+				if listed and file_index is not None:
+					file_index.put(path, mtime, files, subdirs)
+					listed_count += 1
+
+					# commit as we go, so labeler workers sharing the index never wait long on each other
+					if listed_count % 1000 == 0:
+						file_index.commit()
+
+				for name, size, file_mtime in files:
+					if wanted(name, extensions, skip_hidden):
+						yield os.path.join(path, name), size, file_mtime
+
+				if recursive:
+					for name in reversed(subdirs):
+						if not (skip_hidden and name.startswith('.')):
+							stack.append([os.path.join(path, name), None])
+		finally:
+			for pending in stack:
+				if pending[1] is not None:
+					pending[1].cancel()
+
+			if file_index is not None:
+				file_index.close()
+
+# just the paths, in scan order
+def scan_paths(root, extensions=None, **options):
+	for path, size, mtime in scan_files(root, extensions, **options):
+		yield path
@@ -0,0 +1,107 @@
+import os
+import csv
+import time
+import argparse
+from multiprocessing import Pool
+
+import PIL.Image
+
+from image_hashes import BKTree, hashes
+from file_scanner import scan_paths
+
+parser = argparse.ArgumentParser(description='Find near duplicate images across and within the concepts of our downloaded data set using perceptual hashes')
+parser.add_argument('-i', '--imagedir', type=str, help="data set folder of <category>/<concept>/ images", default="Data/download/", required=False)
+parser.add_argument('-o', '--output', type=str, help="csv report of kind,distance,kept,duplicate", default="duplicates.csv", required=False)
+parser.add_argument('-a', '--algorithm', type=str, help="phash or dhash", default="phash", required=False)
+parser.add_argument('-d', '--distance', type=int, help="max Hamming distance between the 64 bit hashes of two duplicates", default=4, required=False)
+parser.add_argument('-w', '--workers', type=int, help="processes hashing images, defaults to one per cpu", default=0, required=False)
+parser.add_argument('-rm', '--remove', type=str, help="delete duplicates rather than only reporting them: within (same concept), cross (another concept) or all", default="", required=False)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+def list_images(imagedir):
+	return scan_paths(imagedir, IMAGE_EXTENSIONS)
+
+
+# the <category>/<concept> folder an image belongs to
+def concept_of(path, imagedir):
+	return os.path.dirname(os.path.relpath(path, imagedir))
+
+
+def hash_image(job):
+	path, algorithm = job
+
+	try:
+		with PIL.Image.open(path) as image:
+			return path, hashes[algorithm](image)
+	except Exception:
+		print('Unable to hash image ' + path)
+		return path, None
+
+
+if __name__ == '__main__':
+
+	args = parser.parse_args()
+
+	if args.algorithm not in hashes:
+		parser.error('--algorithm must be one of ' + ', '.join(sorted(hashes)))
+
+	if args.remove not in ('', 'within', 'cross', 'all'):
+		parser.error('--remove must be within, cross or all')
+
+	start = time.time()
+
+	images = list_images(args.imagedir)
+	print("Hashing images in " + args.imagedir)
+
+	pool = Pool(processes=args.workers or None)
+	hashed = pool.imap(hash_image, ((path, args.algorithm) for path in images), chunksize=64)
+
+	# greedy clustering in path order: an image within distance of one we already kept is its duplicate,
+	# anything else is kept and added to the tree, so the tree only ever holds distinct images
+	tree = BKTree()
+	duplicates = []
+	hashed_count = 0
+
+	for path, value in hashed:
+		hashed_count += 1
+
+		if value is None:
+			continue
+
+		matches = tree.search(value, args.distance)
+		if not matches:
+			tree.add(value, path)
+			continue
+
+		# prefer a copy in our own concept, then the closest
+		concept = concept_of(path, args.imagedir)
+		distance, kept = min(matches, key=lambda match: (concept_of(match[1], args.imagedir) != concept, match[0], match[1]))
+
+		kind = 'within' if concept_of(kept, args.imagedir) == concept else 'cross'
+		duplicates.append((kind, distance, kept, path))
+
+	pool.close()
+	pool.join()
+
+	with open(args.output, 'w', newline='') as report:
+		writer = csv.writer(report)
+		writer.writerow(['kind', 'distance', 'kept', 'duplicate'])
+		for duplicate in duplicates:
+			writer.writerow(duplicate)
+
+	removed = 0
+	if args.remove:
+		for kind, distance, kept, path in duplicates:
+			if args.remove == 'all' or args.remove == kind:
+				os.remove(path)
+				removed += 1
+
+	within = len([duplicate for duplicate in duplicates if duplicate[0] == 'within'])
+
+	print("")
+	print(str(hashed_count) + " images hashed, " + str(len(tree)) + " distinct images, " + str(within) + " duplicates within a concept, " + str(len(duplicates) - within) + " across concepts")
+	if args.remove:
+		print("Removed " + str(removed) + " duplicates")
+	print("Wrote " + args.output + " in " + str(time.time() - start) + " seconds")
@@ -0,0 +1,76 @@
+import PIL.Image
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# yielded in place of an image for paths our skip predicate tells us not to decode
+SKIPPED = object()
+
+# path may also be a file object, say the bytes of an image posted to labeler_service.py
+def load_image(path, resize_to=None):
+
+	try:
+		img = PIL.Image.open(path)
+		#verify apparently breaks the image!?
+		# img.verify()
+
+	except Exception:
+		print('Unable to load image' + str(path))
+		return None
+
+	if resize_to is not None:
+		try:
+			# LANCZOS is the filter formerly known as ANTIALIAS
+			img = img.resize(resize_to, PIL.Image.LANCZOS)
+		except Exception:
+			print('Unable to resize image' + str(path))
+			return None
+
+	# ensure we pass our image as RGB - some images might be single channel or RGBA
+	if img.mode != 'RGB':
+		try:
+			img = img.convert(mode='RGB')
+		except Exception:
+			print('Unable to convert image to RGB' + str(path))
+			return None
+
+	return img
+
+# decode images on a pool of workers while the caller runs inference, yielding (path, image) in path order.
+# at most queue_size images are decoded ahead of the consumer, so memory stays bounded
+# no matter how many paths we are given. workers = 0 decodes inline on the calling thread.
+# skip is called on the calling thread for each path, paths it returns True for are yielded as SKIPPED.
+def decode_images(paths, resize_to=None, workers=0, mode='thread', queue_size=None, skip=None):
+
+	if workers <= 0:
+		for path in paths:
+			if skip is not None and skip(path):
+				yield path, SKIPPED
+			else:
+				yield path, load_image(path, resize_to)
+		return
+
+	if queue_size is None or queue_size < 1:
+		queue_size = workers * 4
+
+	if mode == 'process':
+		executor = ProcessPoolExecutor(max_workers=workers)
+	else:
+		executor = ThreadPoolExecutor(max_workers=workers)
+
+	pending = deque()
+
+	with executor:
+		for path in paths:
+			if skip is not None and skip(path):
+				pending.append( (path, None) )
+			else:
+				pending.append( (path, executor.submit(load_image, path, resize_to)) )
+
+			# wait on the oldest decode once our queue is full
+			if len(pending) >= queue_size:
+				path, future = pending.popleft()
+				yield path, SKIPPED if future is None else future.result()
+
+		while pending:
+			path, future = pending.popleft()
+			yield path, SKIPPED if future is None else future.result()
@@ -0,0 +1,103 @@
+import os
+import csv
+import json
+import numpy
+
+# a packed frame set: images already decoded and resized to our model input size, stored as raw
+# uint8 (rows x height x width x 3) shard files we memory map, so labeling reads frames without decoding anything.
+#   pack.json    {"width": 224, "height": 224, "shard_size": 4096, "shards": [rows in each shard]}
+#   index.csv    path,shard,row for every frame, in the order they were packed
+#   shard-00000.u8 ...
+
+
+def shard_name(number):
+	return 'shard-%05d.u8' % number
+
+def read_index(path):
+	with open(os.path.join(path, 'index.csv'), newline='') as index:
+		reader = csv.reader(index)
+		next(reader)
+
+		for filepath, shard, row in reader:
+			yield filepath, int(shard), int(row)
+
+def packed_paths(path):
+	return [filepath for filepath, shard, row in read_index(path)]
+
+
+# appends frames to the current shard file, a shard at a time, so packing never holds more than one frame
+class FramePackWriter(object):
+
+	def __init__(self, path, size=(224, 224), shard_size=4096):
+		self.path = path
+		self.width, self.height = size
+		self.shard_size = shard_size
+
+		if not os.path.exists(path):
+			os.makedirs(path)
+
+		self.index_file = open(os.path.join(path, 'index.csv'), 'w', newline='')
+		self.index = csv.writer(self.index_file)
+		self.index.writerow(['path', 'shard', 'row'])
+
+		self.shards = []
+		self.shard = None
+
+	def add(self, filepath, image):
+		frame = numpy.asarray(image, dtype=numpy.uint8)
+		if frame.shape != (self.height, self.width, 3):
+			raise ValueError(filepath + ' is ' + str(frame.shape) + ', packed frames are ' + str((self.height, self.width, 3)))
+
+		if self.shard is None or self.shards[-1] >= self.shard_size:
+			if self.shard is not None:
+				self.shard.close()
+
+			self.shards.append(0)
+			self.shard = open(os.path.join(self.path, shard_name(len(self.shards) - 1)), 'wb')
+
+		self.shard.write(frame.tobytes())
+		self.index.writerow([filepath, len(self.shards) - 1, self.shards[-1]])
+		self.shards[-1] += 1
+
+	def close(self):
+		if self.shard is not None:
+			self.shard.close()
+
+		self.index_file.close()
+
+		# written last, a pack without its pack.json never finished
+		with open(os.path.join(self.path, 'pack.json'), 'w') as pack:
+			json.dump({'width': self.width, 'height': self.height, 'shard_size': self.shard_size, 'shards': self.shards}, pack)
+
+
+# reads frames straight out of memory mapped shards. every frame is a read only view into the map,
+# nothing is copied until a model turns it into its own input tensor
+class PackedFrames(object):
+
+	def __init__(self, path):
+		self.path = path
+
+		with open(os.path.join(path, 'pack.json')) as pack:
+			self.pack = json.load(pack)
+
+		self.locations = dict( (filepath, (shard, row)) for filepath, shard, row in read_index(path) )
+		self.maps = {}
+
+	def shard(self, number):
+		if number not in self.maps:
+			shape = (self.pack['shards'][number], self.pack['height'], self.pack['width'], 3)
+			self.maps[number] = numpy.memmap(os.path.join(self.path, shard_name(number)), dtype=numpy.uint8, mode='r', shape=shape)
+
+		return self.maps[number]
+
+	def frame(self, filepath):
+		shard, row = self.locations[filepath]
+		return self.shard(shard)[row]
+
+	# (path, frame) for each of our paths in order, like frame_decoder.decode_images. paths we never packed get None
+	def read(self, paths):
+		for filepath in paths:
+			if filepath in self.locations:
+				yield filepath, self.frame(filepath)
+			else:
+				yield filepath, None
@@ -0,0 +1,353 @@
+import os
+import ssl
+import time
+import random
+import asyncio
+import hashlib
+from urllib.parse import quote, urljoin, urlsplit
+
+# an asyncio image fetch engine for synopsis_categories_and_concepts_image_downloader.py.
+# a fixed number of workers share a queue of (url, destination) jobs and a pool of
+# keep-alive connections per host, so a few hundred concurrent downloads cost one process
+# rather than a process (and a browser) per concept. it speaks just enough HTTP/1.1 for
+# fetching images, so it only needs the standard library.
+
+USER_AGENT = 'Mozilla/5.0 (compatible; CinemaNet image downloader)'
+
+# status codes worth retrying, everything else is final
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp']
+
+
+class FetchError(Exception):
+
+	def __init__(self, message, status=None, retry=True, retry_after=None):
+		super(FetchError, self).__init__(message)
+		self.status = status
+		self.retry = retry
+		self.retry_after = retry_after
+
+
+# a stable file name for an image url, so a re-run finds what it already downloaded
+def image_filename(url):
+	extension = os.path.splitext(urlsplit(url).path)[1].lower()
+	if extension not in IMAGE_EXTENSIONS:
+		extension = '.jpg'
+
+	return hashlib.sha1(url.encode('utf-8')).hexdigest()[:20] + extension
+
+
+# write to a temporary file next to the destination and rename it into place,
+# so an interrupted run never leaves a truncated image behind
+def write_atomic(path, data):
+	temporary = path + '.' + str(os.getpid()) + '.part'
+
+	folder = os.path.dirname(path)
+	if folder and not os.path.exists(folder):
+		os.makedirs(folder, exist_ok=True)
+
+	with open(temporary, 'wb') as f:
+		f.write(data)
+
+	os.replace(temporary, path)
+
+
+# spaces out requests to a single host to at most rate per second.
+# a request only takes its slot once it is due, so one cancelled while waiting holds up nobody
+class HostRateLimiter(object):
+
+	def __init__(self, rate):
+		self.interval = 1.0 / rate if rate > 0 else 0.0
+		self.next_slot = {}
+
+	async def wait(self, host):
+		if not self.interval:
+			return
+
+		while True:
+			now = time.monotonic()
+			slot = self.next_slot.get(host, now)
+
+			if slot <= now:
+				self.next_slot[host] = now + self.interval
+				return
+
+			await asyncio.sleep(slot - now)
+
+
+# idle keep-alive connections per (scheme, host, port), at most per_host open to any one host
+class ConnectionPool(object):
+
+	def __init__(self, per_host=4):
+		self.per_host = per_host
+		self.idle = {}
+		self.slots = {}
+		self.ssl_context = ssl.create_default_context()
+		self.opened = 0
+
+	def slot(self, origin):
+		if origin not in self.slots:
+			self.slots[origin] = asyncio.Semaphore(self.per_host)
+
+		return self.slots[origin]
+
+	# returns (reader, writer, reused)
+	async def connect(self, origin):
+		idle = self.idle.get(origin)
+		while idle:
+			reader, writer = idle.pop()
+			if not writer.is_closing() and not reader.at_eof():
+				return reader, writer, True
+			writer.close()
+
+		scheme, host, port = origin
+		self.opened += 1
+
+		if scheme == 'https':
+			reader, writer = await asyncio.open_connection(host, port, ssl=self.ssl_context, server_hostname=host)
+		else:
+			reader, writer = await asyncio.open_connection(host, port)
+
+		return reader, writer, False
+
+	def release(self, origin, reader, writer, reusable):
+		if reusable and not writer.is_closing():
+			self.idle.setdefault(origin, []).append((reader, writer))
+		else:
+			writer.close()
+
+	def close(self):
+		for connections in self.idle.values():
+			for reader, writer in connections:
+				writer.close()
+
+		self.idle = {}
+
+
+async def read_headers(reader):
+	headers = {}
+
+	while True:
+		line = await reader.readline()
+		if not line:
+			raise FetchError('connection closed in headers')
+
+		line = line.decode('latin-1').strip()
+		if not line:
+			return headers
+
+		name, _, value = line.partition(':')
+		headers[name.strip().lower()] = value.strip()
+
+
+# returns the body and whether the connection can be used for another request
+async def read_body(reader, headers, max_size):
+	if 'chunked' in headers.get('transfer-encoding', '').lower():
+		chunks = []
+		size = 0
+
+		while True:
+			line = await reader.readline()
+			length = int(line.split(b';')[0].strip() or b'0', 16)
+			if length == 0:
+				break
+
+			size += length
+			if size > max_size:
+				raise FetchError('response larger than ' + str(max_size) + ' bytes', retry=False)
+
+			chunks.append(await reader.readexactly(length))
+			await reader.readexactly(2)
+
+		# trailers
+		await read_headers(reader)
+		return b''.join(chunks), True
+
+	if 'content-length' in headers:
+		length = int(headers['content-length'])
+		if length > max_size:
+			raise FetchError('response larger than ' + str(max_size) + ' bytes', retry=False)
+
+		return await reader.readexactly(length), True
+
+	# no framing, the body runs until the server closes the connection
+	body = await reader.read(max_size + 1)
+	if len(body) > max_size:
+		raise FetchError('response larger than ' + str(max_size) + ' bytes', retry=False)
+
+	return body, False
+
+
+class FetchEngine(object):
+
+	def __init__(self, concurrency=32, per_host=4, rate=4.0, retries=3, backoff=1.0, timeout=30.0, max_redirects=5, max_size=50 * 1024 * 1024, user_agent=USER_AGENT):
+		self.concurrency = concurrency
+		self.per_host = per_host
+		self.rate = rate
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.max_redirects = max_redirects
+		self.max_size = max_size
+		self.user_agent = user_agent
+
+	# a single GET on a pooled connection, returns (status, headers, body).
+	# waiting for a connection slot and for the host's rate limit is queueing, not a slow server,
+	# so our timeout only covers connecting, sending and reading the response
+	async def request(self, url):
+		parts = urlsplit(url)
+		if parts.scheme not in ('http', 'https') or not parts.hostname:
+			raise FetchError('unsupported url', retry=False)
+
+		port = parts.port or (443 if parts.scheme == 'https' else 80)
+		origin = (parts.scheme, parts.hostname, port)
+
+		# search results are full of unescaped unicode paths
+		path = quote(parts.path or '/', safe="/%:@!$&'()*+,;=~")
+		if parts.query:
+			path += '?' + quote(parts.query, safe="/%:@!$&'()*+,;=~?")
+
+		host = parts.hostname if parts.port is None else parts.hostname + ':' + str(parts.port)
+		message = ('GET ' + path + ' HTTP/1.1\r\n'
+			'Host: ' + host + '\r\n'
+			'User-Agent: ' + self.user_agent + '\r\n'
+			'Accept: image/*,*/*;q=0.8\r\n'
+			'Accept-Encoding: identity\r\n'
+			'Connection: keep-alive\r\n\r\n').encode('latin-1')
+
+		async with self.pool.slot(origin):
+			await self.limiter.wait(parts.hostname)
+			return await asyncio.wait_for(self.exchange(origin, message), self.timeout)
+
+	async def exchange(self, origin, message):
+		# a pooled connection the server already closed fails before we read anything,
+		# that is not the url's fault so we retry it once on a fresh connection
+		for attempt in range(2):
+			reader, writer, reused = await self.pool.connect(origin)
+			reusable = False
+
+			try:
+				writer.write(message)
+				await writer.drain()
+
+				status_line = await reader.readline()
+				if not status_line:
+					if reused:
+						continue
+					raise FetchError('connection closed before response')
+
+				version, status = status_line.decode('latin-1').split(None, 2)[:2]
+				status = int(status)
+
+				headers = await read_headers(reader)
+				body, reusable = await read_body(reader, headers, self.max_size)
+
+				if version != 'HTTP/1.1' or headers.get('connection', '').lower() == 'close':
+					reusable = False
+
+				return status, headers, body
+			except (ConnectionError, asyncio.IncompleteReadError) as e:
+				if reused and attempt == 0:
+					continue
+				raise FetchError(str(e) or type(e).__name__)
+			except ValueError:
+				raise FetchError('malformed response')
+			finally:
+				self.pool.release(origin, reader, writer, reusable)
+
+		raise FetchError('connection closed before response')
+
+	# follow redirects to an image, raising FetchError for anything else
+	async def get(self, url):
+		for redirect in range(self.max_redirects + 1):
+			status, headers, body = await self.request(url)
+
+			if status in REDIRECT_STATUS and 'location' in headers:
+				url = urljoin(url, headers['location'])
+				continue
+
+			if status != 200:
+				retry_after = headers.get('retry-after')
+				retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+				raise FetchError('HTTP ' + str(status), status, status in RETRY_STATUS, retry_after)
+
+			if not body:
+				raise FetchError('empty response', status)
+
+			# hotlink protection and expired links often answer 200 with a web page
+			if headers.get('content-type', '').lower().startswith('text/'):
+				raise FetchError('not an image (' + headers['content-type'] + ')', status, retry=False)
+
+			return body
+
+		raise FetchError('too many redirects', retry=False)
+
+	# download one url to destination, with retries and exponential backoff.
+	# returns 'downloaded', 'exists' or 'failed: <reason>'
+	async def fetch(self, url, destination):
+		if os.path.exists(destination):
+			return 'exists'
+
+		for attempt in range(self.retries + 1):
+			try:
+				body = await self.get(url)
+			except (FetchError, OSError, asyncio.TimeoutError) as e:
+				if isinstance(e, asyncio.TimeoutError):
+					e = FetchError('timed out')
+				elif not isinstance(e, FetchError):
+					e = FetchError(str(e) or type(e).__name__)
+
+				if not e.retry or attempt == self.retries:
+					return 'failed: ' + str(e)
+
+				delay = e.retry_after if e.retry_after is not None else self.backoff * (2 ** attempt)
+				await asyncio.sleep(delay + random.uniform(0, self.backoff))
+				continue
+
+			write_atomic(destination, body)
+			return 'downloaded'
+
+	async def worker(self, queue, results, progress):
+		while True:
+			job = await queue.get()
+			if job is None:
+				return
+
+			index, url, destination = job
+			results[index] = await self.fetch(url, destination)
+
+			if progress is not None:
+				progress(url, destination, results[index])
+
+	# fetch every (url, destination) job with at most concurrency downloads in flight,
+	# returning a status per job in order. progress(url, destination, status) is called as each one finishes
+	async def run(self, jobs, progress=None):
+		self.pool = ConnectionPool(self.per_host)
+		self.limiter = HostRateLimiter(self.rate)
+
+		# a bounded queue, so millions of jobs never sit in memory as coroutines
+		queue = asyncio.Queue(self.concurrency * 2)
+		results = [None] * len(jobs)
+		workers = [asyncio.ensure_future(self.worker(queue, results, progress)) for i in range(self.concurrency)]
+
+		try:
+			for index, (url, destination) in enumerate(jobs):
+				await queue.put((index, url, destination))
+
+			for worker in workers:
+				await queue.put(None)
+
+			await asyncio.gather(*workers)
+		finally:
+			for worker in workers:
+				worker.cancel()
+			self.pool.close()
+
+		return results
+
+
+def fetch_all(jobs, progress=None, **options):
+	return asyncio.run(FetchEngine(**options).run(jobs, progress))
@@ -0,0 +1,110 @@
+import numpy
+import PIL.Image
+
+# perceptual hashes and a BK-tree to look them up by Hamming distance, for find_duplicates.py.
+# visually identical images (resized, recompressed, slightly recoloured copies) hash to values
+# a few bits apart, and the tree finds every hash within a radius without comparing all pairs.
+
+
+# a 2D DCT-II basis for our pHash, built once
+def dct_matrix(size):
+	n = numpy.arange(size)
+	matrix = numpy.cos(numpy.pi * (2 * n[numpy.newaxis, :] + 1) * n[:, numpy.newaxis] / (2.0 * size))
+	matrix[0] *= 1.0 / numpy.sqrt(2.0)
+	return matrix * numpy.sqrt(2.0 / size)
+
+DCT_32 = dct_matrix(32)
+
+
+def bits_to_int(bits):
+	value = 0
+	for bit in bits.reshape(-1):
+		value = (value << 1) | int(bit)
+	return value
+
+
+def grayscale(image, size):
+	# draft lets jpeg decode at a fraction of full size, we only need a thumbnail
+	image.draft('L', (size[0] * 4, size[1] * 4))
+	return numpy.asarray(image.convert('L').resize(size, PIL.Image.LANCZOS), dtype=numpy.float32)
+
+
+# difference hash, 64 bits of whether each pixel is brighter than its right neighbour
+def dhash(image):
+	pixels = grayscale(image, (9, 8))
+	return bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+# DCT hash, 64 bits of whether each of the lowest frequencies is above their median
+def phash(image):
+	pixels = grayscale(image, (32, 32))
+	frequencies = DCT_32.dot(pixels).dot(DCT_32.T)[:8, :8]
+
+	# the DC term is overall brightness, it would dominate our median
+	median = numpy.median(frequencies.reshape(-1)[1:])
+	return bits_to_int(frequencies > median)
+
+
+hashes = {
+	'phash': phash,
+	'dhash': dhash,
+}
+
+
+def hamming(a, b):
+	return bin(a ^ b).count('1')
+
+
+# a BK-tree over Hamming distance. every child sits under the distance between its hash and its parent's,
+# and the triangle inequality means a search only descends into children within radius of that distance
+class BKTree(object):
+
+	def __init__(self):
+		self.root = None
+		self.size = 0
+
+	# nodes are [hash, [items], {distance: child}]
+	def add(self, value, item):
+		self.size += 1
+
+		if self.root is None:
+			self.root = [value, [item], {}]
+			return
+
+		node = self.root
+		while True:
+			distance = hamming(value, node[0])
+			if distance == 0:
+				node[1].append(item)
+				return
+
+			child = node[2].get(distance)
+			if child is None:
+				node[2][distance] = [value, [item], {}]
+				return
+
+			node = child
+
+	# every (distance, item) within radius of value
+	def search(self, value, radius):
+		if self.root is None:
+			return []
+
+		found = []
+		stack = [self.root]
+
+		while stack:
+			node = stack.pop()
+			distance = hamming(value, node[0])
+
+			if distance <= radius:
+				found.extend((distance, item) for item in node[1])
+
+			for child_distance, child in node[2].items():
+				if distance - radius <= child_distance <= distance + radius:
+					stack.append(child)
+
+		return found
+
+	def __len__(self):
+		return self.size
@@ -0,0 +1,109 @@
+import csv
+import json
+import numpy
+
+
+# read a multi label csv in the AutoML format we write, path,label1,label2...
+# returning a list of paths and a list of label sets
+def read_labeled_csv(path, prefix=''):
+	paths = []
+	labels = []
+
+	with open(path, newline='') as labeled:
+		for row in csv.reader(labeled):
+			if not row:
+				continue
+
+			filepath = row[0]
+			if prefix and filepath.startswith(prefix):
+				filepath = filepath[len(prefix):]
+
+			paths.append(filepath)
+			labels.append(set(label for label in row[1:] if label))
+
+	return paths, labels
+
+# a boolean (images x vocabulary) matrix of which labels each image truly has, labels we have no model for are ignored
+def truth_matrix(vocabulary, labels):
+	columns = dict( (label, column) for column, label in enumerate(vocabulary.labels) )
+	truth = numpy.zeros((len(labels), len(vocabulary)), dtype=bool)
+
+	for row in range(len(labels)):
+		for label in labels[row]:
+			if label in columns:
+				truth[row, columns[label]] = True
+
+	return truth
+
+# for every label at once, the score cutoff with the best recall that still reaches our target precision on held out data.
+# when several cutoffs reach that recall we take the highest, anything below it only adds false positives.
+# returns float32 arrays of thresholds, precision and recall per vocabulary column,
+# labels that never reach the target get an infinite threshold and are never emitted.
+def calibrate(matrix, truth, target_precision):
+	rows = matrix.shape[0]
+
+	# rank every column highest score first, and count true positives above each candidate cutoff
+	order = numpy.argsort(-matrix, axis=0, kind='stable')
+	scores = numpy.take_along_axis(matrix, order, axis=0)
+	hits = numpy.take_along_axis(truth, order, axis=0).cumsum(axis=0)
+
+	predicted = numpy.arange(1, rows + 1)[:, numpy.newaxis]
+	positives = truth.sum(axis=0)
+
+	precision = hits / predicted
+	recall = hits / numpy.maximum(positives, 1)
+
+	# a cutoff keeps every image scoring at least as high, so only the last of a run of equal scores is a real cutoff
+	last_of_tie = numpy.ones(scores.shape, dtype=bool)
+	last_of_tie[:-1] = scores[:-1] != scores[1:]
+
+	valid = (precision >= target_precision) & last_of_tie & (hits > 0)
+
+	# the deepest valid cutoff in each column has the best recall, the first valid one with as many hits is the highest
+	columns = numpy.arange(matrix.shape[1])
+	deepest = rows - 1 - numpy.argmax(valid[::-1], axis=0)
+	best = numpy.argmax(valid & (hits == hits[deepest, columns]), axis=0)
+	found = valid.any(axis=0)
+
+	thresholds = numpy.where(found, scores[best, columns], numpy.inf).astype(numpy.float32)
+	precision = numpy.where(found, precision[best, columns], 0.0).astype(numpy.float32)
+	recall = numpy.where(found, recall[best, columns], 0.0).astype(numpy.float32)
+
+	return thresholds, precision, recall
+
+def save_thresholds(path, vocabulary, target_precision, thresholds, precision, recall, images):
+	calibration = {
+		'target_precision': target_precision,
+		'images': images,
+		'thresholds': {},
+		'precision': {},
+		'recall': {},
+	}
+
+	# json has no infinity, labels we could not calibrate are written as null
+	for column, label in enumerate(vocabulary.labels):
+		calibration['thresholds'][label] = float(thresholds[column]) if numpy.isfinite(thresholds[column]) else None
+		calibration['precision'][label] = round(float(precision[column]), 4)
+		calibration['recall'][label] = round(float(recall[column]), 4)
+
+	with open(path, 'w') as output:
+		json.dump(calibration, output, indent=4, sort_keys=True)
+
+# a float32 threshold per vocabulary column, labels missing from the calibration file are never emitted
+def load_thresholds(path, vocabulary):
+	with open(path) as calibration:
+		cutoffs = json.load(calibration)['thresholds']
+
+	thresholds = numpy.full(len(vocabulary), numpy.inf, dtype=numpy.float32)
+	missing = []
+
+	for column, label in enumerate(vocabulary.labels):
+		if cutoffs.get(label) is not None:
+			thresholds[column] = cutoffs[label]
+		else:
+			missing.append(label)
+
+	if missing:
+		print('No calibrated threshold for ' + str(len(missing)) + ' labels, they will not be emitted: ' + ', '.join(missing))
+
+	return thresholds
@@ -0,0 +1,79 @@
+import numpy
+
+
+# the labels of every model laid out side by side, so a batch of scores is a single float32 (images x labels) matrix
+# rather than a dict per image per model. each model owns a contiguous slice of columns in its own label order,
+# which lets us pick class labels, sort and take the top k for a whole batch with a handful of numpy calls.
+class LabelVocabulary(object):
+
+	def __init__(self, models):
+		self.models = models
+		self.labels = []
+		self.columns = []
+
+		for model in models:
+			if not model.labels:
+				raise ValueError(model.name + ' has no class labels, only classifiers can be used as labelers')
+
+			self.columns.append( slice(len(self.labels), len(self.labels) + len(model.labels)) )
+			self.labels.extend(model.labels)
+
+		self.label_array = numpy.array(self.labels, dtype=object)
+		self.offsets = numpy.array([columns.start for columns in self.columns], dtype=numpy.int64)
+
+	def __len__(self):
+		return len(self.labels)
+
+	def allocate(self, rows):
+		return numpy.zeros((rows, len(self.labels)), dtype=numpy.float32)
+
+	def model_scores(self, matrix, m):
+		return matrix[:, self.columns[m]]
+
+	# the highest scoring label index of each model for every row, an (images x models) int array of vocabulary columns
+	def predicted_columns(self, matrix):
+		indices = numpy.empty((matrix.shape[0], len(self.models)), dtype=numpy.int64)
+
+		for m in range(len(self.models)):
+			indices[:, m] = matrix[:, self.columns[m]].argmax(axis=1)
+
+		return indices + self.offsets
+
+	# the class label of each model for every row, an (images x models) array of label strings
+	def predicted(self, matrix):
+		return self.label_array[self.predicted_columns(matrix)]
+
+	# every label scoring at or above its threshold for every row, a list of label strings per row in vocabulary order
+	def above(self, matrix, thresholds):
+		mask = matrix >= thresholds
+		return [self.label_array[row].tolist() for row in mask]
+
+	# the columns of the k highest scores of every row, highest first
+	def top_k(self, matrix, k):
+		k = min(k, matrix.shape[1])
+		if k <= 0:
+			return numpy.empty((matrix.shape[0], 0), dtype=numpy.int64)
+
+		if k < matrix.shape[1]:
+			indices = numpy.argpartition(-matrix, k - 1, axis=1)[:, :k]
+		else:
+			indices = numpy.tile(numpy.arange(matrix.shape[1]), (matrix.shape[0], 1))
+
+		order = numpy.argsort(-numpy.take_along_axis(matrix, indices, axis=1), axis=1, kind='stable')
+		return numpy.take_along_axis(indices, order, axis=1)
+
+	# every column of every row, highest score first
+	def sorted(self, matrix):
+		return numpy.argsort(-matrix, axis=1, kind='stable')
+
+	# back to a {'Scores': {label: score}, 'Class Label': label} dict per row for each model
+	def predictions(self, matrix):
+		predicted = self.predicted(matrix)
+		results = []
+
+		for m in range(len(self.models)):
+			labels = self.models[m].labels
+			scores = self.model_scores(matrix, m).tolist()
+			results.append([{'Scores': dict(zip(labels, row)), 'Class Label': predicted[i, m]} for i, row in enumerate(scores)])
+
+		return results
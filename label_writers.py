@@ -0,0 +1,365 @@
+import os
+import json
+import math
+import numpy
+import PIL.Image
+
+# parquet output is optional, only needed for --type parquet
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+
+# writes every model's full probability vector as a fixed width float32 column next to its predicted label,
+# one row per image, flushed in row groups as the run streams so memory stays bounded.
+# the label order of each score column is stored in the file metadata as {model name: [labels]}
+class ParquetLabelWriter(object):
+
+	def __init__(self, output, vocabulary, row_group_size=65536):
+		if pyarrow is None:
+			raise ImportError('parquet output needs pyarrow')
+
+		self.output = output
+		self.vocabulary = vocabulary
+		self.models = vocabulary.models
+		self.row_group_size = row_group_size
+
+		self.writer = None
+		self.clear()
+
+	def clear(self):
+		self.paths = []
+		self.matrices = []
+
+	def schema(self):
+		fields = [pyarrow.field('path', pyarrow.string())]
+
+		for model in self.models:
+			fields.append( pyarrow.field(model.name, pyarrow.string()) )
+			fields.append( pyarrow.field(model.name + '.scores', pyarrow.list_(pyarrow.float32(), len(model.labels))) )
+
+		labels = dict( (model.name, model.labels) for model in self.models )
+		return pyarrow.schema(fields, metadata={'labels': json.dumps(labels)})
+
+	def write_batch(self, paths, matrix):
+		self.paths.extend(paths)
+		self.matrices.append(matrix)
+
+		if len(self.paths) >= self.row_group_size:
+			self.flush()
+
+	def flush(self):
+		if not self.paths:
+			return
+
+		if self.writer is None:
+			self.writer = pyarrow.parquet.ParquetWriter(self.output, self.schema())
+
+		matrix = numpy.concatenate(self.matrices)
+		predicted = self.vocabulary.predicted(matrix)
+
+		columns = [pyarrow.array(self.paths, type=pyarrow.string())]
+
+		for m in range(len(self.models)):
+			scores = numpy.ascontiguousarray(self.vocabulary.model_scores(matrix, m))
+			columns.append( pyarrow.array(predicted[:, m].tolist(), type=pyarrow.string()) )
+			columns.append( pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(scores.reshape(-1)), scores.shape[1]) )
+
+		self.writer.write_table( pyarrow.Table.from_arrays(columns, schema=self.schema()) )
+		self.clear()
+
+	def close(self):
+		self.flush()
+
+		# an empty run still gets a valid file
+		if self.writer is None:
+			self.writer = pyarrow.parquet.ParquetWriter(self.output, self.schema())
+
+		self.writer.close()
+
+
+def html_header(title):
+	html_header = """
+	<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN"
+        "http://www.w3.org/TR/html4/loose.dtd">
+
+	<html>
+
+		<head>
+
+		<title>""" + title + """</title>
+		<style>
+
+		body {
+		  font-family: Arial, Sans-serif;
+		  font-size: 10pt;
+		}
+		.masonry-layout {
+		  column-count: 3;
+		  column-gap: 0;
+		}
+		.masonry-layout__panel {
+		  break-inside: avoid;
+		  margin:5px;
+		  padding: 5px;
+		}
+
+		.masonry-layout__panel-content {
+		  padding: 10px;
+		  border-radius: 10px;
+		  border: solid 1px gray;
+		  background-color: #ddd;
+		}
+
+		@media screen and (min-width: 600px) {
+			.masonry-layout {
+			  column-count: 2;
+			 }
+		}
+		@media screen and (min-width: 800px) {
+			.masonry-layout {
+			  column-count: 3;
+			 }
+		}
+
+		@media screen and (min-width: 1000px) {
+			.masonry-layout {
+			  column-count: 4;
+			 }
+		}
+
+		@media screen and (min-width: 1200px) {
+			.masonry-layout {
+			  column-count: 5;
+			 }
+		}
+
+		#bar {
+		 height: 100%;
+		 background-color: green;
+		}
+
+		#label {
+
+		}
+
+		</style>
+
+		<script type="text/javascript">
+		// every score for every image on this page lives in a sidecar we only load once someone asks for it.
+		// browsers block fetch() on file:// urls, so the sidecar is json wrapped in a function call we load as a script
+		var pageScores = null;
+		var pending = [];
+
+		function loadedScores(scores) {
+			pageScores = scores;
+			pending.forEach(showScores);
+			pending = [];
+		}
+
+		function showScores(index) {
+			if (pageScores == null) {
+				pending.push(index);
+				if (pending.length == 1) {
+					var script = document.createElement('script');
+					script.src = document.body.getAttribute('data-scores');
+					document.head.appendChild(script);
+				}
+				return;
+			}
+
+			var html = '<table style="width:100%;">';
+			pageScores[index].forEach(function(item) {
+				var percent = (Math.ceil(item[1] * 10000.0) / 100.0) + '%';
+				html += '<tr><td><div id="bar" style="height:17px; width:' + percent + '">' + item[0] + '</div></td><td>' + percent + '</td></tr>';
+			});
+			html += '</table>';
+
+			document.getElementById('scores-' + index).innerHTML = html;
+		}
+		</script>
+		</head>
+	"""
+	return html_header
+
+def html_entry_scores_table(items):
+	
+	html = '<div style="max-height:300px; overflow-y:scroll">'
+	html += '<table style="width:100%;">'
+
+	for i in range(0, len(items)):
+		label = items[i][0]
+		score = items[i][1]
+
+		percentString = str( math.ceil( score * 10000.0) / 100.0 ) + '%'
+
+		html += '<tr>'
+		html += '<td>'
+		html += '<div id="bar" style="height:17px; width:' + percentString + '">'+ label + '</div>'
+		html += '</td>'
+		html += '<td>' + percentString + '</td>'
+		html += '</tr>'
+
+	html += '</table>'
+	html += '</div>'
+
+	return html
+
+def html_entry(index, filepath, thumbnail, content):
+	html_entry = """
+	<div class="masonry-layout__panel">
+    	<div class="masonry-layout__panel-content" align="center">
+
+		<a href="file://{}" target="_blank"><img src="{}" width="100%" loading="lazy"/></a><br/> {}
+		<div id="scores-{}"><a href="javascript:showScores({})">all scores</a></div>
+		</div>
+	</div>
+	"""
+	return html_entry.format(filepath, thumbnail, content, index, index)
+
+def html_footer(navigation=''):
+	html_footer = """
+	</div>
+	{}
+	</body>
+
+	</html>
+	"""
+	return html_footer.format(navigation)
+
+
+# an html report split into fixed size pages, with an index page at our output path.
+# pages, their score sidecars and small thumbnails live in a <output>_pages folder next to it.
+# each image panel only shows its top k scores (or its predicted labels), every score is loaded on demand.
+class HTMLReportWriter(object):
+
+	def __init__(self, output_path, dir_path, vocabulary, page_size=500, top_k=5, probabilities=False, thumbnail_size=256):
+		self.output_path = output_path
+		self.vocabulary = vocabulary
+		self.dir_path = dir_path
+		self.page_size = page_size
+		self.top_k = top_k
+		self.probabilities = probabilities
+		self.thumbnail_size = thumbnail_size
+
+		self.pages_name = os.path.splitext(os.path.basename(output_path))[0] + '_pages'
+		self.pages_path = os.path.join(os.path.dirname(os.path.abspath(output_path)), self.pages_name)
+		self.thumbnails_path = os.path.join(self.pages_path, 'thumbs')
+
+		for folder in [self.pages_path, self.thumbnails_path]:
+			if not os.path.exists(folder):
+				os.makedirs(folder)
+
+		self.pages = []
+		self.page = None
+		self.images = 0
+
+	def page_name(self, number):
+		return 'page-%05d' % number
+
+	def start_page(self):
+		number = len(self.pages) + 1
+		name = self.page_name(number)
+
+		self.page = open(os.path.join(self.pages_path, name + '.html'), 'w')
+		self.page.write(html_header('Synopsis Data Set Auto Labeler Output - Page ' + str(number)))
+		self.page.write('<body data-scores="' + name + '.js">\n')
+		# a next link only goes at the bottom, once we know there is a page after this one
+		self.page.write(self.navigation(number))
+		self.page.write('<div class="masonry-layout">\n')
+
+		self.page_scores = []
+		self.pages.append(0)
+
+	def navigation(self, number, last=True):
+		links = ['<a href="../' + os.path.basename(self.output_path) + '">index</a>']
+		if number > 1:
+			links.append('<a href="' + self.page_name(number - 1) + '.html">previous</a>')
+		if not last:
+			links.append('<a href="' + self.page_name(number + 1) + '.html">next</a>')
+		return '<p>Page ' + str(number) + ' &mdash; ' + ' | '.join(links) + '</p>\n'
+
+	# a full page stays open until another image arrives, so only pages with a page after them link to it
+	def end_page(self, last=True):
+		if self.page is None:
+			return
+
+		self.page.write(html_footer(self.navigation(len(self.pages), last)))
+		self.page.close()
+		self.page = None
+
+		name = self.page_name(len(self.pages))
+		with open(os.path.join(self.pages_path, name + '.js'), 'w') as sidecar:
+			sidecar.write('loadedScores(' + json.dumps(self.page_scores, separators=(',', ':')) + ');\n')
+
+		# keep the index current so a long run can be reviewed while it is still going
+		self.write_index()
+
+	def write_index(self):
+		with open(self.output_path, 'w') as index:
+			index.write(html_header('Synopsis Data Set Auto Labeler Output'))
+			index.write('<body>\n<p>' + str(self.images) + ' images in ' + str(len(self.pages)) + ' pages</p>\n<ul>\n')
+
+			for number in range(1, len(self.pages) + 1):
+				index.write('<li><a href="' + self.pages_name + '/' + self.page_name(number) + '.html">Page ' + str(number) + '</a> (' + str(self.pages[number - 1]) + ' images)</li>\n')
+
+			index.write('</ul>\n</body>\n</html>\n')
+
+	# a small jpeg next to our pages, so reviewers are not loading full resolution frames by the hundred.
+	# made from the source image, which draft lets jpegs decode at a fraction of their size and keeps its aspect ratio.
+	# image is what we labeled, a fallback if the source is gone, say the originals of a packed frame set
+	def thumbnail(self, filepath, image=None):
+		name = '%08d.jpg' % self.images
+
+		try:
+			img = PIL.Image.open(filepath)
+			img.draft('RGB', (self.thumbnail_size, self.thumbnail_size))
+			img = img.convert('RGB')
+		except OSError as error:
+			if image is None:
+				print('Unable to create thumbnail for ' + filepath + ': ' + str(error))
+				return 'thumbs/' + name
+
+			img = PIL.Image.fromarray(image) if isinstance(image, numpy.ndarray) else image.copy()
+
+		img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+		img.save(os.path.join(self.thumbnails_path, name), quality=80)
+
+		return 'thumbs/' + name
+
+	# labels is an (images x models) array of predicted labels and matrix the matching (images x vocabulary) scores.
+	# images are what we labeled (None where our cache skipped decoding), only used if a source image has gone
+	def write_batch(self, filepaths, labels, matrix, images=None):
+		# sort every row highest scoring first in one go, rounded so our sidecars stay compact
+		order = self.vocabulary.sorted(matrix)
+		rounded = numpy.take_along_axis(matrix, order, axis=1).astype(numpy.float64).round(4).tolist()
+		names = self.vocabulary.label_array[order].tolist()
+
+		for index in range(len(filepaths)):
+			self.write_image(filepaths[index], labels[index], [list(item) for item in zip(names[index], rounded[index])], images[index] if images is not None else None)
+
+	def write_image(self, filepath, labels, items, image=None):
+		if self.page is not None and self.pages[-1] >= self.page_size:
+			self.end_page(last=False)
+
+		if self.page is None:
+			self.start_page()
+
+		self.images += 1
+		self.page_scores.append(items)
+
+		if self.probabilities:
+			content = html_entry_scores_table(items[:self.top_k])
+		else:
+			content = '<br />'.join(labels)
+
+		link = os.path.normpath( os.path.join(self.dir_path, filepath) )
+		self.page.write( html_entry(len(self.page_scores) - 1, link, self.thumbnail(filepath, image), content) )
+
+		self.pages[-1] += 1
+
+	def close(self):
+		self.end_page()
+		self.write_index()
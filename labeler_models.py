@@ -0,0 +1,518 @@
+import os
+import sys
+import fnmatch
+import numpy
+import PIL.Image
+
+# every backend is optional, coremltools only runs inference on macOS
+# and our linux machines run the onnx and numpy backends instead
+try:
+	import coremltools
+except ImportError:
+	coremltools = None
+
+try:
+	import onnxruntime
+except ImportError:
+	onnxruntime = None
+
+# only used to read an onnx model's inputs without building a session
+try:
+	import onnx
+except ImportError:
+	onnx = None
+
+
+# every backend loads a model file and exposes the same interface:
+# name, path, input_name, output_name, is_head (takes a trunk feature vector rather than an image),
+# labels (the class labels in score order, None if unknown or not a classifier) and predict_batch(), returning a {'Scores': {label: score}, 'Class Label': label} dict per input for classifiers,
+# or a {output_name: array} dict per input for a feature extractor.
+# classifiers also have predict_scores(), returning a float32 (inputs x labels) matrix with columns in label order.
+class LabelerModel(object):
+
+	labels = None
+
+	def predict_batch(self, inputs):
+		raise NotImplementedError
+
+	def predict_scores(self, inputs):
+		predictions = self.predict_batch(inputs)
+		return numpy.array([[prediction['Scores'].get(label, 0.0) for label in self.labels] for prediction in predictions], dtype=numpy.float32).reshape(len(inputs), len(self.labels))
+
+	# run a feature extractor, returning one flat float32 vector per image
+	def embed(self, images):
+		predictions = self.predict_batch(images)
+		return [numpy.asarray(prediction[self.output_name], dtype=numpy.float32).reshape(-1) for prediction in predictions]
+
+
+# turn a batch of probability vectors into the same dicts a Core ML classifier returns
+def classifier_predictions(labels, probabilities):
+	predictions = []
+
+	for row in probabilities:
+		scores = dict(zip(labels, [float(score) for score in row]))
+		predictions.append({'Scores': scores, 'Class Label': labels[int(numpy.argmax(row))]})
+
+	return predictions
+
+def load_labels(path):
+	with open(path, 'r') as f:
+		return [line.strip() for line in f if line.strip()]
+
+
+# a Core ML model and what it expects as input.
+# cleaned classifiers take an 'Image', classifier heads split off by
+# synopsis_model_cleaner.py --split take the feature vector from a shared trunk instead.
+# we only read the model description up front, compiling the model waits until we first predict with it,
+# and with a ModelCache neither the description nor the compiled model is rebuilt on the next run.
+class CoreMLModel(LabelerModel):
+
+	def __init__(self, path, cache=None):
+		if coremltools is None:
+			raise ImportError('the coreml backend needs coremltools')
+
+		self.path = path
+		self.name = os.path.basename(path).replace('.mlmodel', '')
+		self.cache = cache
+		self.compiled = None
+
+		metadata = cache.metadata(path) if cache is not None else None
+		if metadata is None:
+			metadata = self.describe(coremltools.models.utils.load_spec(path))
+			if cache is not None:
+				cache.put_metadata(path, metadata)
+
+		self.input_name = metadata['input_name']
+		self.output_name = metadata['output_name']
+		self.is_head = metadata['is_head']
+		self.labels = metadata['labels']
+
+		self.supports_batch = True
+
+	@staticmethod
+	def describe(spec):
+		description = spec.description
+		labels = None
+
+		if spec.HasField('neuralNetworkClassifier'):
+			classifier = spec.neuralNetworkClassifier
+			labels = list(classifier.stringClassLabels.vector) or [str(label) for label in classifier.int64ClassLabels.vector]
+
+		return {
+			'input_name': description.input[0].name,
+			'output_name': description.output[0].name,
+			'is_head': description.input[0].type.WhichOneof('Type') == 'multiArrayType',
+			'labels': labels or None,
+		}
+
+	@property
+	def model(self):
+		if self.compiled is None:
+			self.compiled = self.compile()
+
+		return self.compiled
+
+	# load our compiled .mlmodelc from the cache if we have one, otherwise compile and keep a copy
+	def compile(self):
+		if self.cache is None:
+			return coremltools.models.MLModel(self.path)
+
+		compiled_path = self.cache.compiled_path(self.path, '.mlmodelc')
+		if os.path.exists(compiled_path) and hasattr(coremltools.models, 'CompiledMLModel'):
+			return coremltools.models.CompiledMLModel(compiled_path)
+
+		model = coremltools.models.MLModel(self.path)
+
+		# only coremltools 7+ on macOS compiles models, and only 8+ can load a compiled one
+		try:
+			self.cache.put_compiled(self.path, '.mlmodelc', model.get_compiled_model_path())
+		except Exception as e:
+			print('Unable to cache compiled model ' + self.path + ' (' + str(e) + ')')
+
+		return model
+
+	# run a batch of inputs through our model in a single call
+	# coremltools 7+ accepts a list of feature dicts and returns a list of predictions,
+	# older versions only take a single dict so we fall back to one predict() per input
+	def predict_batch(self, inputs):
+		# frames from a packed frame set are uint8 arrays, Core ML image inputs want a PIL image
+		if not self.is_head:
+			inputs = [PIL.Image.fromarray(value) if isinstance(value, numpy.ndarray) else value for value in inputs]
+
+		features = [{self.input_name: value} for value in inputs]
+
+		if self.supports_batch:
+			try:
+				return list(self.model.predict(features))
+			except (TypeError, ValueError, AttributeError):
+				self.supports_batch = False
+
+		return [self.model.predict(feature) for feature in features]
+
+
+# an ONNX model run on the CPU with onnxruntime, exported by synopsis_model_cleaner.py --split --onnx.
+# classifiers need their labels next to them in <name>.labels.txt, one per line in output order,
+# and their first output must be probabilities (softmax in the graph, not logits), we use it as our scores as is.
+# without a labels file we treat the model as a feature extractor and return its first output.
+# image inputs are scaled by the image_scale and image_bias in the model's metadata, or
+# like our Core ML conversions (old/coreml_converter.py) to -1...1 if it has none
+# like Core ML models the inference session is only created when we first predict. we describe the model
+# from its graph with the onnx package (a session if it is missing), and a ModelCache
+# keeps the description and the optimized graph so later runs skip both.
+class ONNXModel(LabelerModel):
+
+	image_scale = 2.0 / 255.0
+	image_bias = -1.0
+
+	def __init__(self, path, cache=None):
+		if onnxruntime is None:
+			raise ImportError('the onnx backend needs onnxruntime')
+
+		self.path = path
+		self.name = os.path.basename(path).replace('.onnx', '')
+		self.cache = cache
+		self.loaded = None
+
+		metadata = cache.metadata(path) if cache is not None else None
+		if metadata is None:
+			metadata = self.describe_graph(path) if onnx is not None else self.describe(self.session)
+			if cache is not None:
+				cache.put_metadata(path, metadata)
+
+		self.input_name = metadata['input_name']
+		self.output_name = metadata['output_name']
+		self.is_head = metadata['is_head']
+		self.channels_first = metadata['channels_first']
+		self.supports_batch = metadata['supports_batch']
+		self.image_scale = metadata.get('image_scale', ONNXModel.image_scale)
+		self.image_bias = metadata.get('image_bias', ONNXModel.image_bias)
+
+		self.labels = None
+		labels_path = os.path.splitext(path)[0] + '.labels.txt'
+		if os.path.exists(labels_path):
+			self.labels = load_labels(labels_path)
+
+	@staticmethod
+	def describe(session):
+		model_input = session.get_inputs()[0]
+		properties = session.get_modelmeta().custom_metadata_map
+
+		# NCHW or NHWC, and whether the batch dimension is fixed to 1
+		metadata = {
+			'input_name': model_input.name,
+			'output_name': session.get_outputs()[0].name,
+			'is_head': len(model_input.shape) == 2,
+			'channels_first': len(model_input.shape) == 4 and model_input.shape[1] == 3,
+			'supports_batch': model_input.shape[0] != 1,
+		}
+
+		if 'image_scale' in properties:
+			metadata['image_scale'] = float(properties['image_scale'])
+			metadata['image_bias'] = float(properties.get('image_bias', 0.0))
+
+		return metadata
+
+	# the same description read from the model file, external weights are never loaded
+	@staticmethod
+	def describe_graph(path):
+		graph_model = onnx.load(path, load_external_data=False)
+		graph = graph_model.graph
+
+		# older exporters also list initializers as graph inputs
+		initializers = set(initializer.name for initializer in graph.initializer)
+		model_input = [value for value in graph.input if value.name not in initializers][0]
+		shape = [dim.dim_value if dim.HasField('dim_value') else dim.dim_param for dim in model_input.type.tensor_type.shape.dim]
+		properties = dict((prop.key, prop.value) for prop in graph_model.metadata_props)
+
+		metadata = {
+			'input_name': model_input.name,
+			'output_name': graph.output[0].name,
+			'is_head': len(shape) == 2,
+			'channels_first': len(shape) == 4 and shape[1] == 3,
+			'supports_batch': shape[0] != 1,
+		}
+
+		if 'image_scale' in properties:
+			metadata['image_scale'] = float(properties['image_scale'])
+			metadata['image_bias'] = float(properties.get('image_bias', 0.0))
+
+		return metadata
+
+	@property
+	def session(self):
+		if self.loaded is None:
+			self.loaded = self.create_session()
+
+		return self.loaded
+
+	def create_session(self):
+		providers = ['CPUExecutionProvider']
+
+		if self.cache is None:
+			return onnxruntime.InferenceSession(self.path, providers=providers)
+
+		options = onnxruntime.SessionOptions()
+		optimized_path = self.cache.compiled_path(self.path, '.optimized.onnx')
+
+		if os.path.exists(optimized_path):
+			options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+			return onnxruntime.InferenceSession(optimized_path, options, providers=providers)
+
+		# extended rather than all optimizations, which can bake in layouts specific to this machine
+		staged_path = optimized_path + '.' + str(os.getpid()) + '.tmp'
+		options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+		options.optimized_model_filepath = staged_path
+		session = onnxruntime.InferenceSession(self.path, options, providers=providers)
+
+		if os.path.exists(staged_path):
+			os.replace(staged_path, optimized_path)
+
+		return session
+
+	def input_array(self, inputs):
+		if self.is_head:
+			return numpy.stack([numpy.asarray(value, dtype=numpy.float32).reshape(-1) for value in inputs])
+
+		batch = numpy.stack([numpy.asarray(image, dtype=numpy.float32) for image in inputs])
+		batch = batch * self.image_scale + self.image_bias
+
+		if self.channels_first:
+			batch = batch.transpose(0, 3, 1, 2)
+
+		return batch
+
+	def run(self, inputs):
+		if self.supports_batch:
+			outputs = self.session.run([self.output_name], {self.input_name: self.input_array(inputs)})[0]
+		else:
+			outputs = numpy.concatenate([self.session.run([self.output_name], {self.input_name: self.input_array([value])})[0] for value in inputs])
+
+		return outputs.reshape(len(inputs), -1).astype(numpy.float32)
+
+	def predict_scores(self, inputs):
+		return self.run(inputs)
+
+	def predict_batch(self, inputs):
+		outputs = self.run(inputs)
+
+		if self.labels is None:
+			return [{self.output_name: row} for row in outputs]
+
+		return classifier_predictions(self.labels, outputs)
+
+
+# a small dense classifier head evaluated with numpy, exported by synopsis_model_cleaner.py --split as <name>.npz.
+# holds weights_<i> (outputs x inputs) and bias_<i> per fully connected layer, activation_<i> ('relu' or 'linear')
+# and our class labels. the last layer is followed by a softmax.
+# heads load in a few milliseconds, so there is nothing to cache.
+class NumpyHead(LabelerModel):
+
+	def __init__(self, path, cache=None):
+		self.path = path
+		self.name = os.path.basename(path).replace('.npz', '')
+		self.input_name = 'Features'
+		self.output_name = 'Scores'
+		self.is_head = True
+
+		archive = numpy.load(path)
+		self.labels = [str(label) for label in archive['labels']]
+
+		# weights quantized by synopsis_model_cleaner.py --quantize stay int8 (with a scale per output channel) or float16 in memory,
+		# numpy widens them a layer at a time as it multiplies and we apply the int8 scale to the layer's output
+		self.layers = []
+		while 'weights_' + str(len(self.layers)) in archive:
+			index = str(len(self.layers))
+			weights = archive['weights_' + index]
+			if weights.dtype not in (numpy.int8, numpy.float16):
+				weights = weights.astype(numpy.float32)
+
+			scale = archive['scale_' + index].astype(numpy.float32) if 'scale_' + index in archive else None
+			self.layers.append( (weights, scale, archive['bias_' + index].astype(numpy.float32), str(archive['activation_' + index])) )
+
+	def predict_batch(self, inputs):
+		return classifier_predictions(self.labels, self.predict_scores(inputs))
+
+	def predict_scores(self, inputs):
+		x = numpy.stack([numpy.asarray(value, dtype=numpy.float32).reshape(-1) for value in inputs])
+
+		for weights, scale, bias, activation in self.layers:
+			x = x.dot(weights.T.astype(numpy.float32, copy=False))
+			if scale is not None:
+				x *= scale
+			x += bias
+			if activation == 'relu':
+				x = numpy.maximum(x, 0)
+
+		# numerically stable softmax
+		x = numpy.exp(x - x.max(axis=1, keepdims=True))
+		x /= x.sum(axis=1, keepdims=True)
+
+		return x
+
+
+backends = {
+	'coreml': ('.mlmodel', CoreMLModel),
+	'onnx': ('.onnx', ONNXModel),
+	'numpy': ('.npz', NumpyHead),
+}
+
+# which backend we prefer when a model exists in more than one format.
+# numpy heads are close to free, and Core ML only runs on macOS
+def backend_preference(backend='auto'):
+	if backend != 'auto':
+		return [backend]
+
+	if sys.platform == 'darwin':
+		return ['numpy', 'coreml', 'onnx']
+
+	return ['numpy', 'onnx']
+
+def backend_for(path):
+	for backend in backends:
+		if path.endswith(backends[backend][0]):
+			return backend
+
+	return None
+
+def load_model(path, cache=None):
+	backend = backend_for(path)
+	if backend is None:
+		raise ValueError('No backend for model ' + path)
+
+	return backends[backend][1](path, cache)
+
+# the shared feature extractor (backbone) our classifier heads were trained on.
+# we run it once per image and hand the embedding to every head.
+def load_trunk(path, output_name=None, cache=None):
+	trunk = load_model(path, cache)
+
+	if output_name:
+		trunk.output_name = output_name
+
+	return trunk
+
+# does a model name match one of our --models filters, either a glob pattern
+# or a trailing part of the name, so shot.angle matches synopsis.image.shot.angle
+def model_selected(name, selected):
+	for pattern in selected:
+		if fnmatch.fnmatchcase(name, pattern) or name.endswith('.' + pattern):
+			return True
+
+	return False
+
+# load one model per name in our models folder, picking the preferred backend
+# when a model exists in several formats (say angle.mlmodel and angle.npz).
+# with selected (a list of model names or patterns) we skip every other model without opening it
+def load_models(models_path, backend='auto', cache=None, selected=None):
+	models = []
+	preference = backend_preference(backend)
+
+	modelfiles = {}
+	for filename in sorted(os.listdir(models_path)):
+		file_backend = backend_for(filename)
+		if file_backend in preference:
+			name = filename[:-len(backends[file_backend][0])]
+			if selected and not model_selected(name, selected):
+				continue
+
+			modelfiles.setdefault(name, {})[file_backend] = filename
+
+	for name in sorted(modelfiles):
+		for file_backend in preference:
+			if file_backend not in modelfiles[name]:
+				continue
+
+			filename = modelfiles[name][file_backend]
+			model_path = os.path.join(models_path, filename)
+
+			try:
+				model = load_model(model_path, cache)
+			except Exception as e:
+				print('Unable to load model at ' + model_path + ' (' + str(e) + ')')
+				continue
+
+			if model.is_head:
+				print('Loaded classifier head ' + filename)
+			else:
+				print('Loaded model ' + filename)
+
+			models.append(model)
+			break
+
+	return models
+
+# the models a labeling script runs, from its --models argument (comma separated names or patterns, empty for every model).
+# models are only compiled when we first predict with them, and models names does not select are never opened.
+# raises ValueError if a name matches no model, or there are no models the backend can run
+def load_selected_models(models_path, backend='auto', cache=None, names=''):
+	selected = [name.strip() for name in names.split(',') if name.strip()]
+	models = load_models(models_path, backend, cache, selected)
+
+	for name in selected:
+		if not any(model_selected(model.name, [name]) for model in models):
+			raise ValueError('no model in ' + models_path + ' matches --models ' + name)
+
+	if not models:
+		raise ValueError('no models in ' + models_path + ' that the ' + backend + ' backend can run')
+
+	return models
+
+# run a batch of images through all of our models, returning a float32 (images x vocabulary labels) score matrix
+# with each model's scores in its columns of our LabelVocabulary.
+# if we have a trunk its embeddings are computed once and shared by every classifier head.
+# with a cache (and the cache keys of our images) we only run the image / model pairs it is missing,
+# images the cache fully covers may be passed as None.
+def predict_matrix(models, vocabulary, images, trunk=None, cache=None, keys=None):
+	embeddings = [None] * len(images)
+	matrix = vocabulary.allocate(len(images))
+
+	def embed(indices):
+		needed = [i for i in indices if embeddings[i] is None]
+		if not needed:
+			return
+
+		if trunk is None:
+			raise ValueError('classifier heads need a feature extractor, run with --trunk')
+
+		if cache is not None:
+			cached = cache.get_embeddings(trunk, [keys[i] for i in needed])
+			for i, embedding in zip(needed, cached):
+				embeddings[i] = embedding
+			needed = [i for i in needed if embeddings[i] is None]
+
+		if needed:
+			computed = trunk.embed([images[i] for i in needed])
+			for i, embedding in zip(needed, computed):
+				embeddings[i] = embedding
+
+			if cache is not None:
+				cache.put_embeddings(trunk, [keys[i] for i in needed], computed)
+
+	for m in range(len(models)):
+		model = models[m]
+		columns = vocabulary.columns[m]
+		missing = list(range(len(images)))
+
+		if cache is not None:
+			cached = cache.get_scores(model, keys, trunk)
+			for i in range(len(cached)):
+				if cached[i] is not None:
+					matrix[i, columns] = cached[i]
+			missing = [i for i in missing if cached[i] is None]
+
+		if missing:
+			if model.is_head:
+				embed(missing)
+				scores = model.predict_scores([embeddings[i] for i in missing])
+			else:
+				scores = model.predict_scores([images[i] for i in missing])
+
+			matrix[missing, columns] = scores
+
+			if cache is not None:
+				cache.put_scores(model, [keys[i] for i in missing], scores, trunk)
+
+	if cache is not None:
+		cache.commit()
+
+	return matrix
@@ -0,0 +1,171 @@
+import os
+import io
+import json
+import argparse
+import time
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from frame_decoder import load_image
+from micro_batcher import MicroBatcher
+from label_matrix import LabelVocabulary
+from model_cache import ModelCache
+from labeler_models import load_selected_models, load_trunk, predict_matrix
+
+parser = argparse.ArgumentParser(description='Resident labeling service, loads our models once and labels images posted to a local HTTP or Unix socket API')
+parser.add_argument('-m', '--modeldir', type=str, help='folder containing models to use as labelers. Each image to label will be run through each model', default='./Models/Classifiers/Cleaned/', required=False)
+parser.add_argument('-tr', '--trunk', type=str, help="shared feature extractor model (.mlmodel or .onnx), run once per image to feed the classifier heads in modeldir", default="", required=False)
+parser.add_argument('-ms', '--models', type=str, help="comma separated model names or glob patterns to label with, for example shot.angle,shot.framing. defaults to every model in modeldir", default="", required=False)
+parser.add_argument('-mc', '--model-cache', type=str, help="folder caching compiled models and their descriptions by model file hash, shared between runs to cut startup time", default="", required=False)
+parser.add_argument('-be', '--backend', type=str, help="auto, coreml, onnx or numpy. auto prefers numpy heads, then coreml on macOS or onnx elsewhere", default="auto", required=False)
+parser.add_argument('-ho', '--host', type=str, help="address to listen on, keep this local", default="127.0.0.1", required=False)
+parser.add_argument('-p', '--port', type=int, help="port to listen on", default=8765, required=False)
+parser.add_argument('-u', '--socket', type=str, help="listen on this unix socket path instead of a tcp port", default="", required=False)
+parser.add_argument('-b', '--batch-size', type=int, help="max images grouped from concurrent requests into a single batched predict call", default=32, required=False)
+parser.add_argument('-ml', '--max-latency', type=float, help="milliseconds the first image of a batch may wait for others to join it", default=20.0, required=False)
+
+Height = 224 # use the correct input image height
+Width = 224 # use the correct input image width
+
+usage = """POST /label {"paths": ["/path/to/image.jpg", ...]} labels images on disk
+POST /label with the bytes of an image as the body labels that image
+GET /models lists our models and their labels
+"""
+
+
+# run a micro batch of images through every model, one {model name: {'Scores': {label: score}, 'Class Label': label}} per image
+def predict(images):
+	matrix = predict_matrix(models, vocabulary, images, trunk)
+	predictions = vocabulary.predictions(matrix)
+
+	return [dict( (models[m].name, predictions[m][index]) for m in range(len(models)) ) for index in range(len(images))]
+
+# decode on the request thread, so concurrent requests decode in parallel while the batcher runs inference
+def label(source):
+	image = load_image(source, resize_to=(Width, Height))
+	if image is None:
+		return None
+
+	return batcher.submit(image)
+
+class LabelerRequestHandler(BaseHTTPRequestHandler):
+
+	def send_json(self, status, body):
+		data = json.dumps(body).encode('utf-8')
+
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		if self.path == '/models':
+			self.send_json(200, dict( (model.name, model.labels) for model in models ))
+		elif self.path == '/health':
+			self.send_json(200, {'status': 'ok'})
+		else:
+			self.send_json(404, {'error': usage})
+
+	def do_POST(self):
+		if self.path != '/label':
+			self.send_json(404, {'error': usage})
+			return
+
+		body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+		if self.headers.get('Content-Type', '').startswith('application/json'):
+			try:
+				request = json.loads(body.decode('utf-8'))
+				paths = request['paths'] if 'paths' in request else [request['path']]
+
+				# a bare string would be labeled a character at a time, and PIL opens an integer as a file descriptor
+				if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+					raise TypeError('paths must be a list of strings')
+			except (ValueError, KeyError, TypeError):
+				self.send_json(400, {'error': usage})
+				return
+
+			# submit every image before waiting on any, so they can share a batch
+			futures = [label(path) for path in paths]
+			results = []
+
+			for path, future in zip(paths, futures):
+				if future is None:
+					results.append({'path': path, 'error': 'unable to load image'})
+				else:
+					results.append({'path': path, 'models': future.result()})
+
+			self.send_json(200, {'results': results})
+			return
+
+		future = label(io.BytesIO(body))
+		if future is None:
+			self.send_json(400, {'error': 'unable to load image'})
+		else:
+			self.send_json(200, {'models': future.result()})
+
+	# unix socket clients have no address
+	def address_string(self):
+		if isinstance(self.client_address, tuple):
+			return self.client_address[0]
+
+		return self.server.server_address
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+if __name__ == '__main__':
+
+	args = parser.parse_args()
+
+	start = time.time()
+
+	dir_path = os.getcwd()
+	models_path = os.path.normpath( os.path.join(dir_path, args.modeldir) )
+
+	print('Loading Models from: ' + models_path)
+
+	model_cache = None
+	if args.model_cache:
+		model_cache = ModelCache(args.model_cache)
+
+	try:
+		models = load_selected_models(models_path, args.backend, model_cache, args.models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	try:
+		vocabulary = LabelVocabulary(models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	trunk = None
+	if args.trunk:
+		trunk = load_trunk(os.path.normpath( os.path.join(dir_path, args.trunk) ), cache=model_cache)
+	elif any(model.is_head for model in models):
+		parser.error('modeldir contains classifier heads, pass --trunk with the feature extractor they were split from')
+
+	print("Loading models took " + str(time.time() - start) + " seconds")
+
+	batcher = MicroBatcher(predict, args.batch_size, args.max_latency / 1000.0)
+
+	if args.socket:
+		if os.path.exists(args.socket):
+			os.remove(args.socket)
+		server = ThreadingUnixHTTPServer(args.socket, LabelerRequestHandler)
+		print('Listening on ' + args.socket)
+	else:
+		server = ThreadingHTTPServer((args.host, args.port), LabelerRequestHandler)
+		print('Listening on http://' + args.host + ':' + str(args.port))
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		batcher.close()
+
+		if args.socket and os.path.exists(args.socket):
+			os.remove(args.socket)
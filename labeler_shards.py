@@ -0,0 +1,74 @@
+import os
+import sys
+import csv
+import heapq
+import hashlib
+import subprocess
+
+
+# deterministic partition of our walked file list. we hash the path relative to the image folder
+# so machines mounting the archive in different places still agree on which shard owns a file.
+def shard_of(filepath, imagedir, num_shards):
+	relative = os.path.relpath(filepath, imagedir).replace(os.sep, '/')
+	digest = hashlib.md5(relative.encode('utf-8')).hexdigest()
+	return int(digest[:8], 16) % num_shards
+
+def shard_output(output, shard_index, num_shards):
+	return output + '.shard-' + str(shard_index) + '-of-' + str(num_shards)
+
+# start one labeler process per shard, each loading its own models.
+# our own command line is passed through, argparse keeps the last value for repeated options
+# so the per shard overrides we append win.
+def run_workers(script, output, workers, seed):
+	processes = []
+
+	for shard_index in range(workers):
+		argv = [sys.executable, script] + sys.argv[1:]
+		argv += ['--output', shard_output(output, shard_index, workers)]
+		argv += ['--shard-index', str(shard_index), '--num-shards', str(workers), '--workers', '0', '--seed', str(seed)]
+		processes.append(subprocess.Popen(argv))
+
+	failed = 0
+	for shard_index in range(len(processes)):
+		if processes[shard_index].wait() != 0:
+			print('Shard ' + str(shard_index) + ' failed with exit code ' + str(processes[shard_index].returncode))
+			failed += 1
+
+	return failed
+
+# combine per shard CSVs into one file ordered like the single process output.
+# each shard is already in file list order, so this is a streaming k-way merge on list position.
+# raises ValueError for a row whose path is not in our file list, which would break that order,
+# leaving output untouched since we merge into a staging file first.
+def merge_shards(output, shard_paths, all_files, prefix=''):
+	positions = {}
+	for position in range(len(all_files)):
+		positions[prefix + all_files[position]] = position
+
+	def rows(shard_path):
+		with open(shard_path, 'r', newline='') as shard:
+			for row in csv.reader(shard):
+				if not row:
+					continue
+
+				if row[0] not in positions:
+					raise ValueError(shard_path + ' has ' + row[0] + ', which is not in the file list')
+
+				yield positions[row[0]], row
+
+	merged = 0
+	staged = output + '.merging'
+
+	try:
+		with open(staged, 'w', newline='') as merged_output:
+			writer = csv.writer(merged_output)
+
+			for position, row in heapq.merge(*[rows(shard_path) for shard_path in shard_paths], key=lambda item: item[0]):
+				writer.writerow(row)
+				merged += 1
+	except ValueError:
+		os.remove(staged)
+		raise
+
+	os.replace(staged, output)
+	return merged
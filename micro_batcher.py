@@ -0,0 +1,78 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+
+# groups items submitted from many threads into batches for a single predict call.
+# a batch is sent as soon as it is full, or once its oldest item has waited max_latency seconds,
+# so a lone request is never held longer than our latency budget waiting for company.
+# predict takes a list of items and returns one result per item, in order.
+class MicroBatcher(object):
+
+	def __init__(self, predict, batch_size=32, max_latency=0.02):
+		self.predict = predict
+		self.batch_size = batch_size
+		self.max_latency = max_latency
+
+		self.queue = deque()
+		self.condition = threading.Condition()
+		self.running = True
+
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	# returns a Future resolving to this item's result
+	def submit(self, item):
+		future = Future()
+
+		with self.condition:
+			if not self.running:
+				raise RuntimeError('batcher is closed')
+
+			self.queue.append((time.time(), item, future))
+			self.condition.notify()
+
+		return future
+
+	def next_batch(self):
+		with self.condition:
+			while not self.queue and self.running:
+				self.condition.wait()
+
+			if not self.queue:
+				return None
+
+			deadline = self.queue[0][0] + self.max_latency
+			while len(self.queue) < self.batch_size and self.running:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self.condition.wait(remaining)
+
+			return [self.queue.popleft() for i in range(min(self.batch_size, len(self.queue)))]
+
+	def run(self):
+		while True:
+			batch = self.next_batch()
+			if batch is None:
+				return
+
+			try:
+				results = self.predict([item for submitted, item, future in batch])
+			except Exception as e:
+				for submitted, item, future in batch:
+					future.set_exception(e)
+				continue
+
+			for (submitted, item, future), result in zip(batch, results):
+				future.set_result(result)
+
+	# stop taking new items, finish what is queued
+	def close(self):
+		with self.condition:
+			self.running = False
+			self.condition.notify()
+
+		self.thread.join()
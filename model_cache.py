@@ -0,0 +1,74 @@
+import os
+import json
+import shutil
+import tempfile
+
+from embedding_cache import file_digest
+
+
+# a folder of what we learned loading each model file before, keyed by a hash of the file:
+# a <hash>.json of its name, inputs, outputs and labels, so we know every model without opening it,
+# and its compiled form (a Core ML .mlmodelc, an optimized .onnx graph) so we only compile it once.
+# many short labeler runs share one of these so startup no longer pays for a compile per model per run.
+class ModelCache(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.keys = {}
+
+		if not os.path.exists(path):
+			os.makedirs(path)
+
+	# hashing a model is much cheaper than compiling it, but we still only do it once per run
+	def key(self, model_path):
+		if model_path not in self.keys:
+			self.keys[model_path] = file_digest(model_path)
+
+		return self.keys[model_path]
+
+	def metadata(self, model_path):
+		path = os.path.join(self.path, self.key(model_path) + '.json')
+		if not os.path.exists(path):
+			return None
+
+		with open(path) as f:
+			return json.load(f)
+
+	def put_metadata(self, model_path, metadata):
+		path = os.path.join(self.path, self.key(model_path) + '.json')
+
+		# written to a temporary file and renamed so parallel runs never read half a file
+		descriptor, temporary = tempfile.mkstemp(dir=self.path, suffix='.json.tmp')
+		with os.fdopen(descriptor, 'w') as f:
+			json.dump(metadata, f)
+
+		os.replace(temporary, path)
+
+	# where the compiled form of a model lives, it may not exist yet
+	def compiled_path(self, model_path, extension):
+		return os.path.join(self.path, self.key(model_path) + extension)
+
+	# copy a compiled model (a file or a bundle folder) into our cache, first writer wins
+	def put_compiled(self, model_path, extension, compiled):
+		destination = self.compiled_path(model_path, extension)
+		if os.path.exists(destination):
+			return destination
+
+		temporary = tempfile.mkdtemp(dir=self.path, suffix='.tmp')
+		staged = os.path.join(temporary, os.path.basename(destination))
+
+		try:
+			if os.path.isdir(compiled):
+				shutil.copytree(compiled, staged)
+			else:
+				shutil.copyfile(compiled, staged)
+
+			try:
+				os.rename(staged, destination)
+			except OSError:
+				# another run cached it first
+				pass
+		finally:
+			shutil.rmtree(temporary, ignore_errors=True)
+
+		return destination
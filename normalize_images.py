@@ -0,0 +1,127 @@
+import os
+import csv
+import time
+import argparse
+from multiprocessing import Pool
+
+import PIL.Image
+import PIL.ImageOps
+
+from file_scanner import scan_paths
+
+parser = argparse.ArgumentParser(description='Validate every downloaded image, rejecting corrupt files, and write clean RGB copies resized to a max edge into a mirrored folder tree')
+parser.add_argument('-i', '--imagedir', type=str, help="raw data set folder", default="Data/download/", required=False)
+parser.add_argument('-o', '--output', type=str, help="folder the normalized images are written to, mirroring imagedir", default="Data/normalized/", required=False)
+parser.add_argument('-me', '--max-edge', type=int, help="longest edge of the normalized images, smaller images are not upscaled", default=512, required=False)
+parser.add_argument('-mn', '--min-edge', type=int, help="reject images whose shortest edge is smaller than this, tracking pixels and icons", default=32, required=False)
+parser.add_argument('-q', '--quality', type=int, help="jpeg quality of the normalized images", default=90, required=False)
+parser.add_argument('-w', '--workers', type=int, help="processes validating and resizing images, defaults to one per cpu", default=0, required=False)
+parser.add_argument('-r', '--rejects', type=str, help="csv report of rejected images and why", default="rejects.csv", required=False)
+parser.add_argument('-ow', '--overwrite', type=bool, help="normalize images again even if their normalized copy is newer than the original", default=False, required=False)
+
+# parsed at import so spawned workers see our options too
+args = parser.parse_args()
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff')
+
+
+def list_images(imagedir):
+	return scan_paths(imagedir, IMAGE_EXTENSIONS)
+
+
+# every normalized image is a jpeg, other formats keep their name with .jpg appended so nothing collides
+def output_path(path):
+	relative = os.path.relpath(path, args.imagedir)
+	if not relative.lower().endswith(('.jpg', '.jpeg')):
+		relative += '.jpg'
+
+	return os.path.join(args.output, relative)
+
+
+# flatten transparency onto white rather than the black PIL gives us by default
+def to_rgb(img):
+	if img.mode == 'P' and 'transparency' in img.info:
+		img = img.convert('RGBA')
+
+	if img.mode in ('RGBA', 'LA', 'PA'):
+		background = PIL.Image.new('RGB', img.size, (255, 255, 255))
+		background.paste(img, mask=img.convert('RGBA').getchannel('A'))
+		return background
+
+	if img.mode != 'RGB':
+		return img.convert('RGB')
+
+	return img
+
+
+# returns (path, status, reason)
+def normalize(path):
+	destination = output_path(path)
+
+	if not args.overwrite and os.path.exists(destination) and os.path.getmtime(destination) >= os.path.getmtime(path):
+		return path, 'exists', ''
+
+	# verify checks the file structure but leaves the image unusable, so we open it again to decode
+	try:
+		with PIL.Image.open(path) as img:
+			img.verify()
+	except Exception as e:
+		return path, 'rejected', 'corrupt: ' + str(e)
+
+	try:
+		with PIL.Image.open(path) as img:
+			# let jpeg decode straight to a fraction of its size, only as large as our max edge needs.
+			# load() is where truncated files fail
+			img.draft('RGB', (args.max_edge, args.max_edge))
+			img.load()
+
+			img = PIL.ImageOps.exif_transpose(img)
+			img = to_rgb(img)
+
+			if min(img.size) < args.min_edge:
+				return path, 'rejected', 'too small: ' + str(img.size[0]) + 'x' + str(img.size[1])
+
+			img.thumbnail((args.max_edge, args.max_edge), PIL.Image.LANCZOS)
+
+			folder = os.path.dirname(destination)
+			if not os.path.exists(folder):
+				os.makedirs(folder, exist_ok=True)
+
+			# written next to its destination and renamed, so a killed run never leaves half an image
+			temporary = destination + '.' + str(os.getpid()) + '.tmp'
+			img.save(temporary, 'JPEG', quality=args.quality)
+			os.replace(temporary, destination)
+	except Exception as e:
+		return path, 'rejected', 'unreadable: ' + str(e)
+
+	return path, 'normalized', ''
+
+
+if __name__ == '__main__':
+
+	start = time.time()
+
+	images = list_images(args.imagedir)
+	print("Normalizing images from " + args.imagedir + " into " + args.output)
+
+	counts = {'normalized': 0, 'exists': 0, 'rejected': 0}
+
+	# workers take small chunks of paths and hold a single image at a time, so memory stays flat however big the data set is
+	pool = Pool(processes=args.workers or None)
+
+	with open(args.rejects, 'w', newline='') as rejects:
+		writer = csv.writer(rejects)
+		writer.writerow(['path', 'reason'])
+
+		for path, status, reason in pool.imap_unordered(normalize, images, chunksize=32):
+			counts[status] += 1
+
+			if status == 'rejected':
+				print("Rejected " + path + " (" + reason + ")")
+				writer.writerow([path, reason])
+
+	pool.close()
+	pool.join()
+
+	print("")
+	print(str(counts['normalized']) + " normalized, " + str(counts['exists']) + " already normalized, " + str(counts['rejected']) + " rejected in " + str(time.time() - start) + " seconds")
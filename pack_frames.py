@@ -0,0 +1,48 @@
+import argparse
+import time
+
+from frame_decoder import decode_images
+from frame_pack import FramePackWriter
+from file_scanner import scan_paths
+
+parser = argparse.ArgumentParser(description='Decode and resize a folder of frames once, packing them into memory mapped shards auto_labeler.py --packed reads without decoding')
+parser.add_argument('-i', '--imagedir', type=str, help="folder containing the images to pack, pass the same folder to auto_labeler.py", required=True)
+parser.add_argument('-o', '--output', type=str, help="folder to write the packed shards and their index to", default="./packed", required=False)
+parser.add_argument('-e', '--extensions', type=str, help="comma separated image extensions to pack, matched case insensitively, as passed to auto_labeler.py", default=".jpg,.jpeg", required=False)
+parser.add_argument('-sw', '--scan-workers', type=int, help="threads listing imagedir's folders at once", default=8, required=False)
+parser.add_argument('-fi', '--file-index', type=str, help="sqlite file indexing imagedir's folders, so later runs only list folders that changed", default="", required=False)
+parser.add_argument('-ss', '--shard-size', type=int, help="frames per shard file", default=4096, required=False)
+parser.add_argument('-dw', '--decode-workers', type=int, help="number of workers decoding and resizing images, 0 decodes inline", default=4, required=False)
+parser.add_argument('-dm', '--decode-mode', type=str, help="thread or process decode workers", default="thread", required=False)
+
+Height = 224 # use the correct input image height
+Width = 224 # use the correct input image width
+
+
+# the same files, with the same paths, auto_labeler.py would label
+def list_files(args):
+	extensions = [extension.strip() for extension in args.extensions.split(',') if extension.strip()]
+	return scan_paths(args.imagedir, extensions, workers=args.scan_workers, index=args.file_index or None)
+
+if __name__ == '__main__':
+
+	args = parser.parse_args()
+
+	start = time.time()
+
+	all_files = list_files(args)
+	print("Packing images from " + args.imagedir + " into " + args.output)
+
+	writer = FramePackWriter(args.output, (Width, Height), args.shard_size)
+	packed = 0
+
+	for filepath, image in decode_images(all_files, resize_to=(Width, Height), workers=args.decode_workers, mode=args.decode_mode):
+		if image is None:
+			continue
+
+		writer.add(filepath, image)
+		packed += 1
+
+	writer.close()
+
+	print( str(packed) + " images packed into " + str(len(writer.shards)) + " shards in " + str(time.time() - start) + " seconds")
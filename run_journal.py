@@ -0,0 +1,104 @@
+import os
+import time
+
+
+# sidecar journal of the files a labeling run has completed, so a crashed or pre-empted run can resume.
+# completed paths are only committed together with the size of the output file they were written into,
+# after both have been fsynced, so on resume we can cut off any rows written after our last checkpoint
+# and neither lose nor duplicate work.
+# a sampled run records its seed on the first line, so resuming it labels the same sample.
+# we checkpoint every `every` completed images or `interval` seconds, whichever comes first,
+# since every checkpoint is two fsyncs and those are slow on network file systems.
+class RunJournal(object):
+
+	def __init__(self, output_path, every=5000, interval=30.0):
+		self.output_path = output_path
+		self.path = output_path + '.journal'
+		self.every = every
+		self.interval = interval
+		self.pending = []
+		self.journal = None
+		self.last_checkpoint = time.time()
+
+	# the seed of the run that wrote our journal, None if it was not sampled or there is no journal
+	def recorded_seed(self):
+		if not os.path.exists(self.path):
+			return None
+
+		with open(self.path, 'r') as journal:
+			line = journal.readline()
+
+		if line.startswith('#seed '):
+			return int(line[len('#seed '):])
+
+		return None
+
+	# returns the set of completed paths and the output size they correspond to,
+	# dropping anything past the last checkpoint from both the journal and the output.
+	# raises ValueError rather than touch an output with no journal, which no run we could resume wrote
+	def resume(self):
+		completed = set()
+		offset = 0
+
+		if not os.path.exists(self.output_path) or os.path.getsize(self.output_path) == 0:
+			return completed, offset
+
+		if not os.path.exists(self.path):
+			raise ValueError(self.output_path + ' has no journal to resume from, it is complete or was not written by a resumable run')
+
+		paths = []
+		committed = 0
+		with open(self.path, 'r') as journal:
+			while True:
+				line = journal.readline()
+				if not line:
+					break
+
+				line = line.rstrip('\n')
+				if line.startswith('#seed '):
+					committed = journal.tell()
+				elif line.startswith('#offset '):
+					completed.update(paths)
+					paths = []
+					offset = int(line[len('#offset '):])
+					committed = journal.tell()
+				else:
+					paths.append(line)
+
+		os.truncate(self.path, committed)
+		os.truncate(self.output_path, offset)
+
+		return completed, offset
+
+	def start(self, resume=False, seed=None):
+		self.journal = open(self.path, 'a' if resume else 'w')
+		self.last_checkpoint = time.time()
+
+		if seed is not None and self.journal.tell() == 0:
+			self.journal.write('#seed ' + str(seed) + '\n')
+			self.journal.flush()
+
+	def record(self, paths):
+		self.pending.extend(paths)
+
+	def due(self):
+		return len(self.pending) >= self.every or time.time() - self.last_checkpoint >= self.interval
+
+	# make our output rows durable first, then commit the paths they belong to
+	def checkpoint(self, output):
+		output.flush()
+		os.fsync(output.fileno())
+		offset = os.fstat(output.fileno()).st_size
+
+		for path in self.pending:
+			self.journal.write(path + '\n')
+		self.journal.write('#offset ' + str(offset) + '\n')
+
+		self.journal.flush()
+		os.fsync(self.journal.fileno())
+
+		self.pending = []
+		self.last_checkpoint = time.time()
+
+	def close(self):
+		self.journal.close()
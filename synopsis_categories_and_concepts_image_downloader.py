@@ -1,8 +1,29 @@
 import os
+import argparse
 from multiprocessing import Pool
 
-from google_images_download import \
-    google_images_download  # importing the library
+from image_fetcher import fetch_all
+from download_manifest import DownloadManifest
+
+# only needed to collect image urls from google image search, not to download them
+try:
+    from google_images_download import \
+        google_images_download  # importing the library
+except ImportError:
+    google_images_download = None
+
+parser = argparse.ArgumentParser(description='Download images for every category and concept, collecting image urls from google image search into a manifest and fetching them concurrently')
+parser.add_argument('-o', '--output', type=str, help="folder images are downloaded into as <category>/<concept>/", default="Data/download/", required=False)
+parser.add_argument('-mf', '--manifest', type=str, help="json recording every concept's search terms, urls, downloaded images and status, so re-runs only fetch what is missing. defaults to <output>/manifest.json", default="", required=False)
+parser.add_argument('-l', '--limit', type=int, help="target number of images per concept", default=300, required=False)
+parser.add_argument('-rf', '--retry-failed', type=bool, help="retry urls that failed on a previous run", default=False, required=False)
+parser.add_argument('-cd', '--chromedriver', type=str, help="chromedriver used by google_images_download to collect urls", default="/Users/K/Documents/DEV/Machine Learning/video-understanding/CinemaNet-2019-ishangupta3-clone/chromedriver.exe", required=False)
+parser.add_argument('-cw', '--collect-workers', type=int, help="concepts collecting urls at once, each drives its own browser", default=2, required=False)
+parser.add_argument('-c', '--concurrency', type=int, help="images downloading at once", default=64, required=False)
+parser.add_argument('-ph', '--per-host', type=int, help="max open keep-alive connections to any one host", default=4, required=False)
+parser.add_argument('-r', '--rate', type=float, help="max requests per second to any one host, 0 for no limit", default=4.0, required=False)
+parser.add_argument('-rt', '--retries', type=int, help="retries per image after a timeout, connection error or retryable http status, with exponential backoff", default=3, required=False)
+parser.add_argument('-t', '--timeout', type=float, help="seconds before a single request times out", default=30.0, required=False)
 
 # please see https://github.com/Synopsis/CinemaNet/blob/master/Labels.md for specifics.
 
@@ -439,49 +460,133 @@ categories_and_concepts = {
 # print categories_and_classes
 
 
-def download_images(arguments):
+# search google images for a concept, returning its image urls without downloading them
+def collect_urls(arguments):
     response = google_images_download.googleimagesdownload()  # class instantiation
-    paths = response.download(arguments)
-    print(paths)
+    result = response.download(arguments)
 
+    # newer versions return (paths, errors), paths maps each search term to its urls
+    paths = result[0] if isinstance(result, tuple) else result
 
-allArguments = []
+    urls = []
+    seen = set()
+    for search_urls in paths.values():
+        for url in search_urls:
+            if url and url not in seen:
+                seen.add(url)
+                urls.append(url)
+
+    print("Collected " + str(len(urls)) + " urls for " + arguments["image_directory"])
+    return urls
 
-try:
-    os.stat("Data/download/")
-except:
-    os.mkdir("Data/download/")
 
-for category_key in categories_and_concepts:
-    # concepts is an array of dictionaries
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    manifest = DownloadManifest(args.manifest or os.path.join(args.output, "manifest.json"), args.output)
+
+    entries = []
+    collecting = []
+    allArguments = []
 
     try:
-        os.stat("Data/download/" + category_key)
+        os.stat(args.output)
     except:
-        os.mkdir("Data/download/" + category_key)
-
-    print("Category: " + category_key)
-    category_concepts = categories_and_concepts[category_key]
-    for concept in category_concepts:
-        for concept_key in concept:
-            print("Concept: " + concept_key)
-            searchterms = ", ".join(concept[concept_key])
-            print("Search Terms: " + searchterms)
-
-            try:
-                os.stat("Data/download/" + category_key +
-                        "/" + concept_key)
-            except:
-                os.mkdir("Data/download/" + category_key + "/" + concept_key)
-
-            response = google_images_download.googleimagesdownload()  # class instantiation
-            arguments = {"chromedriver": "/Users/K/Documents/DEV/Machine Learning/video-understanding/CinemaNet-2019-ishangupta3-clone/chromedriver.exe", "keywords": searchterms, "limit": 300, "print_urls": False,
-                         "output_directory": "Data/download/"+category_key, "image_directory": concept_key,  "size": "medium", "format": "jpg", "no_numbering": True}
-            #arguments = { "keywords" : searchterms, "limit" : 100, "print_urls" : False, "output_directory" : "Data/download/"+category_key, "image_directory" : concept_key,  "size" : "medium", "save_source" : concept_key + "sources", "format" : "jpg" }
-            allArguments.append(arguments)
-
-# concurrent google image downloaders
-pool = Pool(processes=10)
-results = pool.map(download_images, allArguments)
-
-print(results)
+        os.makedirs(args.output)
+
+    for category_key in categories_and_concepts:
+        # concepts is an array of dictionaries
+
+        try:
+            os.stat(os.path.join(args.output, category_key))
+        except:
+            os.mkdir(os.path.join(args.output, category_key))
+
+        category_concepts = categories_and_concepts[category_key]
+        for concept in category_concepts:
+            for concept_key in concept:
+                try:
+                    os.stat(os.path.join(args.output, category_key, concept_key))
+                except:
+                    os.mkdir(os.path.join(args.output, category_key, concept_key))
+
+                entry = manifest.concept(category_key, concept_key, args.limit)
+                entries.append(entry)
+
+                if args.retry_failed:
+                    manifest.retry_failed(entry)
+
+                # only search for new concepts and search terms, or concepts that ran out of urls to try
+                searchterms = manifest.new_search_terms(entry, concept[concept_key])
+                limit = args.limit
+
+                if not searchterms and entry['status'] == 'exhausted' and manifest.needed(entry):
+                    searchterms = concept[concept_key]
+                    limit = len(entry['urls']) + manifest.needed(entry)
+
+                if not searchterms:
+                    continue
+
+                print("Concept: " + concept_key)
+                print("Search Terms: " + ", ".join(searchterms))
+
+                arguments = {"chromedriver": args.chromedriver, "keywords": ", ".join(searchterms), "limit": limit, "print_urls": False,
+                             "output_directory": os.path.join(args.output, category_key), "image_directory": concept_key, "size": "medium", "format": "jpg", "no_numbering": True, "no_download": True}
+                #arguments = { "keywords" : searchterms, "limit" : 100, "print_urls" : False, "output_directory" : "Data/download/"+category_key, "image_directory" : concept_key,  "size" : "medium", "save_source" : concept_key + "sources", "format" : "jpg" }
+                collecting.append((entry, searchterms))
+                allArguments.append(arguments)
+
+    # searching still drives a browser per concept, but only for what the manifest is missing
+    if allArguments and google_images_download is None:
+        print(str(len(allArguments)) + " concepts need urls, collecting them needs google_images_download")
+    elif allArguments:
+        pool = Pool(processes=args.collect_workers)
+        results = pool.map(collect_urls, allArguments)
+        pool.close()
+
+        for (entry, searchterms), urls in zip(collecting, results):
+            manifest.add_urls(entry, searchterms, urls)
+
+        manifest.save()
+
+    # every missing image of every concept shares one asyncio fetch engine.
+    # urls that fail leave their concept short, so we go round again with its next untried urls
+    fetched = {}
+
+    def progress(url, destination, status):
+        recorded = manifest.record(owners[destination], url, status)
+        fetched[recorded] = fetched.get(recorded, 0) + 1
+
+        if recorded == 'failed':
+            print(status + " " + url)
+
+        # an interrupted run keeps what it fetched
+        if sum(fetched.values()) % 500 == 0:
+            manifest.save()
+
+    while True:
+        jobs = []
+        owners = {}
+
+        for entry in entries:
+            for url in manifest.pending(entry, manifest.needed(entry)):
+                destination = manifest.destination(entry, url)
+                jobs.append((url, destination))
+                owners[destination] = entry
+
+        if not jobs:
+            break
+
+        print("Fetching " + str(len(jobs)) + " images")
+        fetch_all(jobs, progress, concurrency=args.concurrency, per_host=args.per_host, rate=args.rate, retries=args.retries, timeout=args.timeout)
+
+    statuses = [manifest.update_status(entry) for entry in entries]
+    manifest.save()
+
+    print("")
+    for status in ['downloaded', 'duplicate', 'failed']:
+        print(str(fetched.get(status, 0)) + " " + status)
+
+    for status in ['complete', 'incomplete', 'exhausted']:
+        print(str(statuses.count(status)) + " concepts " + status)
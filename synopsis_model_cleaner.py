@@ -1,16 +1,57 @@
 import os 
 import argparse
+import numpy
 import coremltools
 from coremltools.models import datatypes
+from coremltools.proto import Model_pb2
+
+from file_scanner import scan_paths
+
+# onnx exports for our linux labelers are optional
+try:
+	import onnx
+	import onnx.helper
+	import onnx.numpy_helper
+except ImportError:
+	onnx = None
+
+try:
+	import onnxmltools
+except ImportError:
+	onnxmltools = None
+
+# weight quantization moved around between coremltools releases
+try:
+	from coremltools.models.neural_network import quantization_utils
+except ImportError:
+	quantization_utils = None
 
 
 parser = argparse.ArgumentParser(description='Clean up a folder of ML model classifiers and fix label names, add metadata to mlmodels and fix tensor names')
 parser.add_argument('-m', '--modeldir', type=str, help='folder containing core ml models to clean', default='./Models/Classifiers/AutoML/', required=False)
 parser.add_argument('-o', '--outputdir', type=str, help='folder containing core ml models to clean', default='./Models/Classifiers/Cleaned/', required=False)
+parser.add_argument('-s', '--split', type=bool, help='also split each model into a shared feature extractor (outputdir/Trunk) and a small classifier head (outputdir/Heads, as .mlmodel and .npz)', default=False, required=False)
+parser.add_argument('-x', '--onnx', type=bool, help='with --split, also export the trunk (needs onnxmltools) and every head (needs onnx) as .onnx, with <name>.labels.txt next to each head, for the onnx backend on linux', default=False, required=False)
+parser.add_argument('-q', '--quantize', type=str, help='comma separated weight bit widths, 8 and or 16, to also save weight quantized copies of every cleaned model (and trunk and heads with --split) to outputdir/Quantized/<bits>bit', default='', required=False)
 
 
 args = parser.parse_args()
 
+quantizeBits = [int(bits) for bits in args.quantize.split(',') if bits.strip()]
+
+for bits in quantizeBits:
+	if bits not in [8, 16]:
+		parser.error('we only quantize weights to 8 or 16 bits, not ' + str(bits))
+
+if args.onnx and not args.split:
+	parser.error('--onnx exports the split trunk and heads, run with --split too')
+
+if args.onnx and onnx is None:
+	parser.error('--onnx needs the onnx package, pip install onnx onnxmltools')
+
+if quantizeBits and quantization_utils is None:
+	parser.error('this coremltools has no quantization_utils, update coremltools to quantize models')
+
 # load our models into our models array
 dir_path = os.getcwd()
 
@@ -50,6 +91,239 @@ labelReplaceMap = {
 					'location.exterior' : 'shot.location.exterior'
 }
 
+# the 1280 length feature vector at the end of our backbone, this is where we split models into trunk and head
+featureTensorName = 'mnas_v4_a_140_1/feature_network/feature_extractor/Mean:0'
+featureLength = 1280
+
+# layers of the first trunk we export, every other model must share them to reuse a single trunk
+trunkLayers = None
+
+def featureLayerIndex(nn):
+	for i in range(len(nn.layers)):
+		if featureTensorName in nn.layers[i].output:
+			return i
+
+	return -1
+
+def featureDescription(feature):
+	feature.name = "Features"
+	feature.shortDescription = "Feature Vector"
+	feature.type.multiArrayType.dataType = coremltools.proto.FeatureTypes_pb2.ArrayFeatureType.ArrayDataType.Value('DOUBLE')
+	feature.type.multiArrayType.shape.extend([featureLength])
+
+# image in, feature vector out - every layer up to and including our feature layer
+def exportTrunk(spec, index):
+	trunk = Model_pb2.Model()
+	trunk.specificationVersion = spec.specificationVersion
+
+	trunk.description.input.add().CopyFrom(spec.description.input[0])
+	featureDescription(trunk.description.output.add())
+
+	nn = trunk.neuralNetwork
+	nn.preprocessing.extend(spec.neuralNetworkClassifier.preprocessing)
+	nn.layers.extend(spec.neuralNetworkClassifier.layers[:index + 1])
+
+	# identity layer so our feature vector has a friendly output name
+	layer = nn.layers.add()
+	layer.name = 'feature_extractor_output'
+	layer.input.append(featureTensorName)
+	layer.output.append('Features')
+	layer.activation.linear.alpha = 1.0
+
+	model = coremltools.models.MLModel(trunk)
+	model.author = 'Synopsis Project - Anton Marini'
+	model.license = 'BSD'
+	model.short_description = 'Feature Extractor'
+	model.versionString =  '1.0 Beta 1'
+	return model
+
+# feature vector in, scores and class label out - every layer after our feature layer
+def exportHead(spec, index):
+	head = Model_pb2.Model()
+	head.CopyFrom(spec)
+
+	nn = head.neuralNetworkClassifier
+	del nn.layers[:index + 1]
+	del nn.preprocessing[:]
+
+	for layer in nn.layers:
+		for i in range(len(layer.input)):
+			if layer.input[i] == featureTensorName:
+				layer.input[i] = 'Features'
+
+	head.description.input[0].type.Clear()
+	featureDescription(head.description.input[0])
+
+	return head
+
+# 8 bit weights are symmetric int8 with a float scale per output channel, 16 bit weights are float16
+def quantizeNumpyWeights(arrays, index, weights, bits):
+	if bits == 8:
+		scale = numpy.abs(weights).max(axis=1) / 127.0
+		scale[scale == 0] = 1.0
+		arrays['weights_' + index] = numpy.round(weights / scale[:, None]).astype(numpy.int8)
+		arrays['scale_' + index] = scale.astype(numpy.float32)
+	elif bits == 16:
+		arrays['weights_' + index] = weights.astype(numpy.float16)
+	else:
+		arrays['weights_' + index] = weights
+
+# the weights of a head that is only fully connected layers, as we save them for a numpy head (see labeler_models.py),
+# or None if the head has layers numpy cannot run
+def numpyHeadArrays(head, bits=None):
+	nn = head.neuralNetworkClassifier
+	arrays = {'labels': numpy.array(list(nn.stringClassLabels.vector))}
+	layers = 0
+
+	for layer in nn.layers:
+		kind = layer.WhichOneof('layer')
+
+		if kind == 'innerProduct':
+			params = layer.innerProduct
+			weights = numpy.array(params.weights.floatValue, dtype=numpy.float32)
+			if len(weights) != params.outputChannels * params.inputChannels:
+				print('Unsupported weight format in ' + layer.name + ', not exporting numpy or onnx head')
+				return None
+
+			quantizeNumpyWeights(arrays, str(layers), weights.reshape(params.outputChannels, params.inputChannels), bits)
+			arrays['bias_' + str(layers)] = numpy.array(params.bias.floatValue, dtype=numpy.float32) if params.hasBias else numpy.zeros(params.outputChannels, dtype=numpy.float32)
+			arrays['activation_' + str(layers)] = numpy.array('linear')
+			layers += 1
+		elif kind == 'activation' and layer.activation.WhichOneof('NonlinearityType') == 'ReLU' and layers > 0:
+			arrays['activation_' + str(layers - 1)] = numpy.array('relu')
+		elif kind in ['flatten', 'softmax']:
+			continue
+		else:
+			print('Unsupported layer ' + layer.name + ' (' + str(kind) + '), not exporting numpy or onnx head')
+			return None
+
+	return arrays
+
+# heads that are only fully connected layers can also run without Core ML, as a numpy head
+def exportNumpyHead(head, path, bits=None):
+	arrays = numpyHeadArrays(head, bits)
+	if arrays is not None:
+		numpy.savez(path, **arrays)
+
+# the same head as an onnx graph for onnxruntime on linux: Features (batch x 1280) in,
+# Scores out as probabilities - the softmax is part of the graph, our labelers treat onnx outputs as scores.
+# its labels go next to it in <name>.labels.txt
+def exportOnnxHead(head, path):
+	arrays = numpyHeadArrays(head)
+	if arrays is None:
+		return
+
+	initializers = []
+	nodes = []
+	tensor = 'Features'
+	layers = 0
+
+	while 'weights_' + str(layers) in arrays:
+		index = str(layers)
+		initializers.append(onnx.numpy_helper.from_array(arrays['weights_' + index], 'weights_' + index))
+		initializers.append(onnx.numpy_helper.from_array(arrays['bias_' + index], 'bias_' + index))
+		nodes.append(onnx.helper.make_node('Gemm', [tensor, 'weights_' + index, 'bias_' + index], ['dense_' + index], transB=1))
+		tensor = 'dense_' + index
+
+		if str(arrays['activation_' + index]) == 'relu':
+			nodes.append(onnx.helper.make_node('Relu', [tensor], ['relu_' + index]))
+			tensor = 'relu_' + index
+
+		layers += 1
+
+	labels = [str(label) for label in arrays['labels']]
+	nodes.append(onnx.helper.make_node('Softmax', [tensor], ['Scores'], axis=1))
+
+	graph = onnx.helper.make_graph(nodes, os.path.basename(path).replace('.onnx', ''),
+		[onnx.helper.make_tensor_value_info('Features', onnx.TensorProto.FLOAT, ['batch', featureLength])],
+		[onnx.helper.make_tensor_value_info('Scores', onnx.TensorProto.FLOAT, ['batch', len(labels)])],
+		initializers)
+
+	# an older ir version, so runtimes older than our onnx package can load it
+	model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid('', 13)], ir_version=8)
+	onnx.checker.check_model(model)
+	onnx.save(model, path)
+
+	with open(path.replace('.onnx', '.labels.txt'), 'w') as f:
+		f.write('\n'.join(labels) + '\n')
+
+# the trunk as an onnx graph. we convert it without its Core ML preprocessing and record the scale and bias
+# in the model metadata instead, which labeler_models.py applies to the raw pixels before running it
+def exportOnnxTrunk(trunk, path):
+	if onnxmltools is None:
+		print('onnxmltools is not installed, not exporting an onnx trunk')
+		return
+
+	spec = Model_pb2.Model()
+	spec.CopyFrom(trunk.get_spec())
+
+	scale = 1.0
+	bias = 0.0
+	preprocessing = spec.neuralNetwork.preprocessing
+	if len(preprocessing) and preprocessing[0].WhichOneof('preprocessor') == 'scaler':
+		scaler = preprocessing[0].scaler
+		scale = scaler.channelScale or 1.0
+		bias = scaler.redBias
+		if not (scaler.redBias == scaler.greenBias == scaler.blueBias):
+			print('Trunk has a different bias per channel, the onnx trunk will use the red bias for every channel')
+
+	del spec.neuralNetwork.preprocessing[:]
+
+	model = onnxmltools.convert_coreml(spec, 'synopsis.image.feature_extractor')
+	onnx.helper.set_model_props(model, {'image_scale': str(scale), 'image_bias': str(bias)})
+	onnx.save(model, path)
+
+def quantizedPath(bits, folder):
+	return cleaned_path + '/Quantized/' + str(bits) + 'bit' + folder
+
+# the weight quantized copies of a model, one for each of our --quantize bit widths
+def saveQuantized(model, folder, fileName):
+	for bits in quantizeBits:
+		quantized = quantization_utils.quantize_weights(model, bits)
+
+		# off macOS we get the quantized spec back rather than a model
+		if not isinstance(quantized, coremltools.models.MLModel):
+			quantized = coremltools.models.MLModel(quantized)
+
+		quantized.save(quantizedPath(bits, folder) + '/' + fileName)
+
+def splitModel(spec, modelName, modelNameReadable):
+	global trunkLayers
+
+	index = featureLayerIndex(spec.neuralNetworkClassifier)
+	if index < 0:
+		print('No feature layer in ' + modelName + ', not splitting')
+		return
+
+	layers = [layer.SerializeToString() for layer in spec.neuralNetworkClassifier.layers[:index + 1]]
+
+	# heads are only interchangeable if their backbone weights are identical
+	if trunkLayers is None:
+		trunkLayers = layers
+		trunk = exportTrunk(spec, index)
+		trunk.save(cleaned_path + '/Trunk/synopsis.image.feature_extractor.mlmodel')
+		saveQuantized(trunk, '/Trunk', 'synopsis.image.feature_extractor.mlmodel')
+		if args.onnx:
+			exportOnnxTrunk(trunk, cleaned_path + '/Trunk/synopsis.image.feature_extractor.onnx')
+	elif layers != trunkLayers:
+		print('Backbone of ' + modelName + ' differs from our shared trunk, not splitting')
+		return
+
+	head = exportHead(spec, index)
+	exportNumpyHead(head, cleaned_path + '/Heads/' + modelName + '.npz')
+	if args.onnx:
+		exportOnnxHead(head, cleaned_path + '/Heads/' + modelName + '.onnx')
+	for bits in quantizeBits:
+		exportNumpyHead(head, quantizedPath(bits, '/Heads') + '/' + modelName + '.npz', bits)
+
+	model = coremltools.models.MLModel(head)
+	model.author = 'Synopsis Project - Anton Marini'
+	model.license = 'BSD'
+	model.short_description = modelNameReadable + ' Classifier Head'
+	model.versionString =  '1.0 Beta 1'
+	model.save(cleaned_path + '/Heads/' + modelName +  '.mlmodel')
+	saveQuantized(model, '/Heads', modelName + '.mlmodel')
+
 def updateModel(originalModelFileName):
 
 	modelName = originalModelFileName.replace('.mlmodel', '')
@@ -147,22 +421,35 @@ def updateModel(originalModelFileName):
 	model.short_description = modelNameReadable + ' Classifier'
 	model.versionString =  '1.0 Beta 1'
 	model.save(cleaned_path + '/' + modelName +  '.mlmodel')
+	saveQuantized(model, '', modelName + '.mlmodel')
 
 	# Save the model
 
+	if args.split:
+		splitModel(spec, modelName, modelNameReadable)
+
 
 model_paths = []
 
-for filename in os.listdir(models_path):
-	if filename.endswith('.mlmodel'):	
-		model_path = filename
+for path in scan_paths(models_path, '.mlmodel', recursive=False):
+	model_paths.append(os.path.basename(path))
 
-		if model_path:
-			model_paths.append(model_path)
-	else:
-		continue
 
 
+if args.split:
+	for folder in ['/Trunk', '/Heads']:
+		try:
+			os.stat(cleaned_path + folder)
+		except:
+			os.mkdir(cleaned_path + folder)
+
+for bits in quantizeBits:
+	for folder in ['', '/Trunk', '/Heads'] if args.split else ['']:
+		if not os.path.exists(quantizedPath(bits, folder)):
+			os.makedirs(quantizedPath(bits, folder))
+
+# sort so the trunk always comes from the same model
+model_paths.sort()
 
 for model_path in model_paths:
 	updateModel(model_path)
@@ -0,0 +1,33 @@
+import numpy
+
+from label_calibration import calibrate
+
+
+def test_calibrate_picks_the_highest_cutoff_of_tied_recall():
+	matrix = numpy.array([[.9], [.3], [.2], [.1]], dtype=numpy.float32)
+	truth = numpy.array([[True], [True], [False], [False]])
+
+	# .3 and .2 both find every positive, only .3 does it without a false positive
+	thresholds, precision, recall = calibrate(matrix, truth, 0.6)
+
+	assert numpy.isclose(thresholds[0], .3)
+	assert precision[0] == 1.0
+	assert recall[0] == 1.0
+
+def test_calibrate_prefers_recall_over_precision_above_target():
+	matrix = numpy.array([[.9], [.8], [.7], [.6]], dtype=numpy.float32)
+	truth = numpy.array([[True], [False], [True], [False]])
+
+	thresholds, precision, recall = calibrate(matrix, truth, 0.6)
+
+	assert numpy.isclose(thresholds[0], .7)
+	assert recall[0] == 1.0
+
+def test_calibrate_never_emits_labels_below_target():
+	matrix = numpy.array([[.9], [.8]], dtype=numpy.float32)
+	truth = numpy.array([[False], [True]])
+
+	thresholds, precision, recall = calibrate(matrix, truth, 0.9)
+
+	assert numpy.isinf(thresholds[0])
+	assert recall[0] == 0.0
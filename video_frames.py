@@ -0,0 +1,66 @@
+import threading
+import subprocess
+import PIL.Image
+from queue import Queue
+
+
+# read frames straight out of an ffmpeg pipe as raw rgb, sampled and scaled by ffmpeg itself,
+# so there is no jpeg encode, disk write, re-read or re-decode between the video and our models.
+# yields (timestamp in seconds, PIL image) for one frame every interval seconds.
+def video_frames(path, size=(224, 224), interval=3.0, threads=0):
+	width, height = size
+	frame_bytes = width * height * 3
+
+	command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-threads", str(threads), "-i", str(path),
+		"-vf", "fps=1/" + str(interval) + ",scale=" + str(width) + ":" + str(height) + ":flags=lanczos",
+		"-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+
+	process = subprocess.Popen(command, stdout=subprocess.PIPE)
+
+	try:
+		index = 0
+		while True:
+			data = process.stdout.read(frame_bytes)
+			if len(data) < frame_bytes:
+				break
+
+			yield index * interval, PIL.Image.frombytes('RGB', size, data)
+			index += 1
+	finally:
+		process.stdout.close()
+
+		# our consumer may stop early, dont leave ffmpeg blocked on a full pipe
+		if process.poll() is None:
+			process.kill()
+
+		if process.wait() not in [0, -9]:
+			print('ffmpeg failed on ' + str(path))
+
+# run an iterable on a background thread, at most size items ahead of the consumer,
+# so ffmpeg keeps decoding while our models run
+def prefetch(iterable, size=64):
+	queue = Queue(maxsize=size)
+	done = object()
+
+	def produce():
+		try:
+			for item in iterable:
+				queue.put(item)
+		except Exception as e:
+			queue.put(e)
+		queue.put(done)
+
+	thread = threading.Thread(target=produce)
+	thread.daemon = True
+	thread.start()
+
+	while True:
+		item = queue.get()
+
+		if item is done:
+			return
+
+		if isinstance(item, Exception):
+			raise item
+
+		yield item
@@ -0,0 +1,112 @@
+import os
+import csv
+import argparse
+import time
+
+from video_frames import prefetch, video_frames
+from file_scanner import scan_paths
+from label_matrix import LabelVocabulary
+from model_cache import ModelCache
+from labeler_models import load_selected_models, load_trunk, predict_matrix
+
+parser = argparse.ArgumentParser(description='Label frames streamed straight out of video files, without extracting them to jpgs first')
+parser.add_argument('-m', '--modeldir', type=str, help='folder containing models to use as labelers. Each frame to label will be run through each model', default='./Models/Classifiers/Cleaned/', required=False)
+parser.add_argument('-i', '--videodir', type=str, help="folder containing videos to be labeled", required=True)
+parser.add_argument('-e', '--extension', type=str, help="extension of the videos to label", default=".mp4", required=False)
+parser.add_argument('-o', '--output', type=str, help="destination csv of video, timestamp and labels", default="./labels.csv", required=False)
+parser.add_argument('-pre', '--prefix', type=str, help="video url prefix, useful for adding a cloud storage provider URL for example", default="", required=False)
+parser.add_argument('-n', '--interval', type=float, help="seconds between sampled frames", default=3.0, required=False)
+parser.add_argument('-b', '--batch-size', type=int, help="number of frames sent to each model in a single batched predict call", default=32, required=False)
+parser.add_argument('-th', '--threads', type=int, help="ffmpeg decode threads per video, 0 lets ffmpeg decide", default=0, required=False)
+parser.add_argument('-tr', '--trunk', type=str, help="shared feature extractor model (.mlmodel or .onnx), run once per frame to feed the classifier heads in modeldir", default="", required=False)
+parser.add_argument('-ms', '--models', type=str, help="comma separated model names or glob patterns to label with, for example shot.angle,shot.framing. defaults to every model in modeldir", default="", required=False)
+parser.add_argument('-mc', '--model-cache', type=str, help="folder caching compiled models and their descriptions by model file hash, shared between runs to cut startup time", default="", required=False)
+parser.add_argument('-be', '--backend', type=str, help="auto, coreml, onnx or numpy. auto prefers numpy heads, then coreml on macOS or onnx elsewhere", default="auto", required=False)
+
+Height = 224 # use the correct input image height
+Width = 224 # use the correct input image width
+
+
+def list_videos(videodir, extension):
+	return scan_paths(videodir, [e.strip() for e in extension.split(',') if e.strip()])
+
+# every sampled frame of every video, in order, as (video, timestamp, image).
+# videos stream in from the scan, seen counts them as they start
+def all_frames(videos, seen):
+	for video in videos:
+		seen.append(video)
+		print('labeling ' + video)
+		for timestamp, image in video_frames(video, size=(Width, Height), interval=args.interval, threads=args.threads):
+			yield video, timestamp, image
+
+def label_batch(writer, batch):
+	images = [image for video, timestamp, image in batch]
+	predicted = vocabulary.predicted(predict_matrix(models, vocabulary, images, trunk)).tolist()
+
+	for index in range(len(batch)):
+		video, timestamp, image = batch[index]
+		writer.writerow([args.prefix + video, '%.3f' % timestamp] + predicted[index])
+
+if __name__ == '__main__':
+
+	args = parser.parse_args()
+
+	start = time.time()
+
+	dir_path = os.getcwd()
+	models_path = os.path.normpath( os.path.join(dir_path, args.modeldir) )
+
+	print('Loading Models from: ' + models_path)
+
+	model_cache = None
+	if args.model_cache:
+		model_cache = ModelCache(args.model_cache)
+
+	try:
+		models = load_selected_models(models_path, args.backend, model_cache, args.models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	try:
+		vocabulary = LabelVocabulary(models)
+	except ValueError as error:
+		parser.error(str(error))
+
+	trunk = None
+	if args.trunk:
+		trunk = load_trunk(os.path.normpath( os.path.join(dir_path, args.trunk) ), cache=model_cache)
+	elif any(model.is_head for model in models):
+		parser.error('modeldir contains classifier heads, pass --trunk with the feature extractor they were split from')
+
+	print("Loading models took " + str(time.time() - start) + " seconds")
+
+	start = time.time()
+
+	videos = list_videos(args.videodir, args.extension)
+	seen = []
+	frames = 0
+
+	with open(args.output, 'w', newline='') as output:
+		writer = csv.writer(output)
+
+		batch = []
+		for frame in prefetch(all_frames(videos, seen), size=args.batch_size * 2):
+			batch.append(frame)
+
+			if len(batch) >= args.batch_size:
+				label_batch(writer, batch)
+				frames += len(batch)
+				batch = []
+
+		if batch:
+			label_batch(writer, batch)
+			frames += len(batch)
+
+	predictiontime = time.time() - start
+
+	print("")
+	print("Completed Processing")
+	print("")
+	print( str(frames) + " frames from " + str(len(seen)) + " videos processed in " + str(predictiontime) + " seconds")
+	print( str( frames/predictiontime ) + " frames / second")
+	print("")